@@ -0,0 +1,448 @@
+import os
+import sys
+import zlib
+import gzip
+import uuid
+import json
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import BinaryIO, Callable, Dict, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+
+# WARC record types used by the archive
+RESPONSE = "response"       # http headers and original body of a resource
+CONVERSION = "conversion"   # body of a page or stylesheet once its links have been remapped
+METADATA = "metadata"       # manifest of a resource
+
+LOCAL_URL_HEADER = "X-Skydump-Local-Url"
+
+SCAN_CHUNK_SIZE = 1 << 20
+STREAM_CHUNK_SIZE = 1 << 16
+MANIFEST_CACHE_SIZE = 4096
+
+
+class FilePayload:
+    """
+    Payload of a record read in chunks from a file while the record is written, instead of being held in memory.
+
+    open_file: fn() -> binary file object of the content, eg. a decompressing reader
+    prefix: bytes written before the content, eg. the http headers of a response
+    size: size of the content, counted by reading it once if not given (eg. for compressed content)
+    """
+
+    def __init__(self, open_file: Callable[[], BinaryIO], prefix: bytes = b"", size: Optional[int] = None):
+        self.open_file = open_file
+        self.prefix = prefix
+        self.size = size
+
+    @classmethod
+    def from_path(cls, path: str, prefix: bytes = b""):
+        return cls(lambda: open(path, "rb"), prefix, os.path.getsize(path))
+
+    def __len__(self):
+        if self.size is None:
+            self.size = sum(len(chunk) for chunk in self._read())
+        return len(self.prefix) + self.size
+
+    def _read(self):
+        with self.open_file() as fp:
+            while True:
+                chunk = fp.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    def chunks(self):
+        if self.prefix:
+            yield self.prefix
+        yield from self._read()
+
+
+class Archive:
+    """
+    Packs the crawled resources in a few large WARC segment files instead of a file, a manifest and
+    a backup per resource. Records are appended to the current segment, which is rotated once it
+    reaches segment_size, and located through a SQLite index by url or by local url.
+
+    A segment is only appended to, the last record of an url and type being the current one.
+    A record is indexed once fully written: a crash leaves at worst an unindexed record at the
+    end of a segment, reindex() rebuilds the index from the segments themselves.
+
+    root: directory of the segments and of the index
+    segment_size: size in bytes after which a new segment is started
+    compress: gzip every record on its own (.warc.gz), records can still be read at random
+    remove_files: delete the files, manifest and backup of a resource from the mirror once packed
+    """
+
+    def __init__(self, root: str = "archive", segment_size: int = 1 << 30, compress: bool = True, remove_files: bool = True):
+        self.root = root
+        self.segment_size = segment_size
+        self.compress = compress
+        self.remove_files = remove_files
+
+        os.makedirs(root, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._segment = None
+        self._segment_name = None
+        # Last read manifests, every link to an archived resource reading its manifest
+        self._manifests: OrderedDict = OrderedDict()
+
+        self.connection = sqlite3.connect(os.path.join(root, "index.db"), check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS records (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    url TEXT NOT NULL,
+                    type TEXT NOT NULL,
+                    local_url TEXT NOT NULL,
+                    content_type TEXT NOT NULL,
+                    segment TEXT NOT NULL,
+                    offset INTEGER NOT NULL,
+                    length INTEGER NOT NULL
+                )
+            """)
+            self.connection.execute("CREATE INDEX IF NOT EXISTS records_url ON records (url, type, seq)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS records_local_url ON records (local_url, type, seq)")
+
+    def close(self):
+        with self._lock:
+            if self._segment is not None:
+                self._segment.close()
+                self._segment = None
+            self.connection.close()
+
+    def _segment_names(self):
+        return sorted(f for f in os.listdir(self.root) if f.startswith("segment-") and ".warc" in f)
+
+    def _open_segment(self):
+        # The last segment is appended to until it is full
+        if self._segment is None:
+            names = self._segment_names()
+            if names:
+                self._segment_name = names[-1]
+                self._segment = open(os.path.join(self.root, self._segment_name), "ab")
+
+        if self._segment is None or self._segment.tell() >= self.segment_size:
+            if self._segment is not None:
+                self._segment.close()
+
+            n_segment = int(self._segment_name.split("-")[1].split(".")[0]) + 1 if self._segment_name else 0
+            self._segment_name = f"segment-{n_segment:05d}.warc" + (".gz" if self.compress else "")
+            self._segment = open(os.path.join(self.root, self._segment_name), "ab")
+
+        return self._segment
+
+    def _write_record(self, segment, url: str, record_type: str, payload, local_url: str, content_type: str):
+        length = len(payload)
+        headers = [
+            "WARC/1.0",
+            f"WARC-Type: {record_type}",
+            f"WARC-Record-ID: <urn:uuid:{uuid.uuid4()}>",
+            f"WARC-Date: {datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')}",
+            f"WARC-Target-URI: {url}",
+            f"{LOCAL_URL_HEADER}: {local_url}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {length}",
+        ]
+
+        # Every record is a gzip member of its own, compressed chunk by chunk as the payload is read
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if self.compress else None
+
+        def _write(data: bytes):
+            segment.write(compressor.compress(data) if compressor is not None else data)
+
+        _write(("\r\n".join(headers) + "\r\n\r\n").encode("utf-8"))
+
+        written = 0
+        for chunk in (payload.chunks() if isinstance(payload, FilePayload) else [payload]):
+            _write(chunk)
+            written += len(chunk)
+
+        if written != length:
+            raise Exception(f"Payload of {url} changed while being archived: {written} bytes instead of {length}")
+
+        _write(b"\r\n\r\n")
+        if compressor is not None:
+            segment.write(compressor.flush())
+
+    def append(self, records):
+        """
+        Appends records, a list of (url, record type, payload, local url, content type), and indexes them.
+        A payload is either bytes or a FilePayload streamed into the segment.
+        """
+
+        with self._lock:
+            segment = self._open_segment()
+            start = segment.tell()
+
+            rows = []
+            try:
+                for url, record_type, payload, local_url, content_type in records:
+                    offset = segment.tell()
+                    self._write_record(segment, url, record_type, payload, local_url, content_type)
+                    rows.append((url, record_type, local_url, content_type, self._segment_name, offset, segment.tell() - offset))
+
+                segment.flush()
+            except BaseException:
+                # Drops the records written so far, the segment ending with the last indexed one
+                segment.truncate(start)
+                segment.seek(start)
+                raise
+
+            with self.connection:
+                self.connection.executemany("INSERT INTO records (url, type, local_url, content_type, segment, offset, length) "
+                                            "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+            for url, record_type, _, _, _ in records:
+                if record_type == METADATA:
+                    self._manifests.pop(url, None)
+
+    def _find(self, column: str, value: str, record_type: str):
+        with self._lock:
+            return self.connection.execute(f"SELECT segment, offset, length, content_type FROM records "
+                                           f"WHERE {column} = ? AND type = ? ORDER BY seq DESC LIMIT 1",
+                                           (value, record_type)).fetchone()
+
+    def _read_record(self, segment: str, offset: int, length: int) -> Tuple[Dict[str, str], bytes]:
+        with open(os.path.join(self.root, segment), "rb") as fp:
+            fp.seek(offset)
+            record = fp.read(length)
+
+        if segment.endswith(".gz"):
+            record = gzip.decompress(record)
+
+        return parse_record(record)
+
+    def read(self, url: str, record_type: str = RESPONSE) -> Optional[bytes]:
+        """
+        Returns the payload of the last record of url of type record_type, None if there's none.
+        """
+
+        row = self._find("url", url, record_type)
+        if row is None:
+            return None
+        return self._read_record(*row[:3])[1]
+
+    def read_manifest(self, url: str) -> Optional[dict]:
+        """
+        Returns the last manifest packed for url, None if there's none.
+        The returned dict is shared and must not be modified.
+        """
+
+        with self._lock:
+            if url in self._manifests:
+                self._manifests.move_to_end(url)
+                return self._manifests[url]
+
+        payload = self.read(url, METADATA)
+        if payload is None:
+            return None
+
+        data = json.loads(payload)
+
+        with self._lock:
+            self._manifests[url] = data
+            if len(self._manifests) > MANIFEST_CACHE_SIZE:
+                self._manifests.popitem(last=False)
+
+        return data
+
+    def read_local(self, local_url: str) -> Optional[Tuple[bytes, str]]:
+        """
+        Returns the body of the file that would be at local_url in the mirror and its content type,
+        the remapped body if there's one, the original one otherwise.
+        """
+
+        row = self._find("local_url", local_url, CONVERSION)
+        if row is not None:
+            return self._read_record(*row[:3])[1], row[3]
+
+        row = self._find("local_url", local_url, RESPONSE)
+        if row is not None:
+            return split_http_response(self._read_record(*row[:3])[1])[1], row[3]
+
+        return None
+
+    def has(self, url: str) -> bool:
+        return self._find("url", url, METADATA) is not None
+
+    def reindex(self):
+        """
+        Rebuilds the index by scanning every segment, eg. after a crash or to merge copied segments.
+        """
+
+        with self._lock:
+            self._manifests.clear()
+            if self._segment is not None:
+                self._segment.close()
+                self._segment = None
+
+            with self.connection:
+                self.connection.execute("DELETE FROM records")
+
+                for segment in self._segment_names():
+                    rows = []
+                    for offset, length, record in scan_segment(os.path.join(self.root, segment)):
+                        headers, payload = parse_record(record)
+                        rows.append((headers.get("WARC-Target-URI", ""), headers.get("WARC-Type", ""),
+                                     headers.get(LOCAL_URL_HEADER, ""), headers.get("Content-Type", ""),
+                                     segment, offset, length))
+
+                    self.connection.executemany("INSERT INTO records (url, type, local_url, content_type, segment, offset, length) "
+                                                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                    logging.info(f"Indexed {len(rows)} records of segment {segment}")
+
+    def extract(self, destination: str = "."):
+        """
+        Writes every packed file back as a regular mirror under destination.
+        """
+
+        with self._lock:
+            local_urls = [row[0] for row in self.connection.execute(
+                "SELECT DISTINCT local_url FROM records WHERE type IN (?, ?) AND local_url != ''", (RESPONSE, CONVERSION))]
+
+        for local_url in local_urls:
+            body, content_type = self.read_local(local_url)
+
+            path = os.path.join(destination, local_url)
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "wb") as fp:
+                fp.write(body)
+
+        logging.info(f"Extracted {len(local_urls)} files to {destination}")
+
+    def serve(self, host: str = "127.0.0.1", port: int = 8000):
+        """
+        Serves the packed mirror over http, the path of a request being the local url of a file.
+        """
+
+        archive = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                local_url = unquote(urlsplit(self.path).path).lstrip("/")
+                if local_url == "" or local_url.endswith("/"):
+                    local_url += "index.html"
+
+                found = archive.read_local(local_url)
+                if found is None:
+                    self.send_error(404)
+                    return
+
+                body, content_type = found
+                self.send_response(200)
+                self.send_header("Content-Type", content_type or "application/octet-stream")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), _Handler)
+        logging.info(f"Serving archive {self.root} on http://{host}:{port}/")
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+
+
+def parse_record(record: bytes) -> Tuple[Dict[str, str], bytes]:
+    header_block, _, rest = record.partition(b"\r\n\r\n")
+
+    headers = {}
+    for line in header_block.decode("utf-8").split("\r\n")[1:]:
+        name, _, value = line.partition(":")
+        headers[name.strip()] = value.strip()
+
+    return headers, rest[:int(headers.get("Content-Length", len(rest)))]
+
+
+def build_http_response(status: int, headers: Dict[str, str], body: bytes) -> bytes:
+    header_block = f"HTTP/1.1 {status}\r\n" + "".join(f"{name}: {value}\r\n" for name, value in headers.items() if value)
+    return header_block.encode("ISO-8859-1") + b"\r\n" + body
+
+
+def split_http_response(payload: bytes) -> Tuple[bytes, bytes]:
+    header_block, _, body = payload.partition(b"\r\n\r\n")
+    return header_block, body
+
+
+def scan_segment(path: str):
+    """
+    Yields the (offset, length, record) of every complete record of a segment, stopping at a truncated one.
+    """
+
+    with open(path, "rb") as fp:
+        if path.endswith(".gz"):
+            # Every record is a gzip member of its own
+            offset = 0
+            pending = b""
+
+            while True:
+                chunk = pending or fp.read(SCAN_CHUNK_SIZE)
+                if not chunk:
+                    return
+
+                decompressor = zlib.decompressobj(wbits=31)
+                fed = 0
+                record = []
+
+                while True:
+                    record.append(decompressor.decompress(chunk))
+                    fed += len(chunk)
+                    if decompressor.eof:
+                        break
+                    chunk = fp.read(SCAN_CHUNK_SIZE)
+                    if not chunk:
+                        return
+
+                length = fed - len(decompressor.unused_data)
+                yield offset, length, b"".join(record)
+
+                offset += length
+                pending = decompressor.unused_data
+
+        else:
+            while True:
+                offset = fp.tell()
+
+                header_block = b""
+                while not header_block.endswith(b"\r\n\r\n"):
+                    line = fp.readline()
+                    if not line:
+                        return
+                    header_block += line
+
+                headers, _ = parse_record(header_block)
+                payload = fp.read(int(headers.get("Content-Length", 0)) + 4)
+                if len(payload) < int(headers.get("Content-Length", 0)) + 4:
+                    return
+
+                yield offset, fp.tell() - offset, header_block + payload
+
+
+if __name__ == "__main__":
+    # python archive.py extract archive/ mirror/
+    # python archive.py serve archive/ 8000
+    # python archive.py reindex archive/
+    logging.basicConfig(level=logging.INFO)
+
+    if len(sys.argv) < 3 or sys.argv[1] not in ("extract", "serve", "reindex"):
+        print("Usage: python archive.py extract|serve|reindex <archive> [<destination>|<port>]")
+        sys.exit(2)
+
+    archive = Archive(sys.argv[2], remove_files=False)
+
+    if sys.argv[1] == "extract":
+        archive.extract(sys.argv[3] if len(sys.argv) > 3 else ".")
+    elif sys.argv[1] == "serve":
+        archive.serve(port=int(sys.argv[3]) if len(sys.argv) > 3 else 8000)
+    else:
+        archive.reindex()
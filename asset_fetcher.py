@@ -0,0 +1,82 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from models.link import Link
+
+
+class AssetFetcher:
+    """
+    Worker pool retrieving the links of a page concurrently, with a bound on the number
+    of simultaneous retrievals per host. Links are updated in place, so the link list keeps
+    its order and post-processing stays deterministic.
+
+    max_workers: number of links retrieved at the same time
+    per_host_concurrency: number of links of the same host retrieved at the same time
+    """
+
+    def __init__(self, max_workers: int = 8, per_host_concurrency: int = 4):
+        self.max_workers = max_workers
+        self.per_host_concurrency = per_host_concurrency
+
+        self._executor = None
+        self._host_semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _host_semaphore(self, domain: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            if domain not in self._host_semaphores:
+                self._host_semaphores[domain] = threading.BoundedSemaphore(self.per_host_concurrency)
+            return self._host_semaphores[domain]
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="asset_fetcher")
+            return self._executor
+
+    def _run(self, retrieve: Callable[[Link], Link], l: Link):
+        self._local.in_worker = True
+        try:
+            with self._host_semaphore(l.resource.domain or ""):
+                return retrieve(l)
+        finally:
+            self._local.in_worker = False
+
+    def retrieve(self, retrieve: Callable[[Link], Link], links: List[Link]):
+        """
+        Calls retrieve on every link, the first link of each url in the pool and the
+        following ones afterwards, once their url has been retrieved.
+        """
+
+        first_links = []
+        duplicate_links = []
+        seen_urls = set()
+
+        for l in links:
+            if l.resource.remote_url in seen_urls:
+                duplicate_links.append(l)
+            else:
+                seen_urls.add(l.resource.remote_url)
+                first_links.append(l)
+
+        # A retrieval started from a worker (eg. a stylesheet crawled while revalidating a page)
+        # is run in place, waiting on the pool from one of its workers could deadlock it
+        if self.max_workers <= 1 or getattr(self._local, "in_worker", False):
+            for l in first_links:
+                retrieve(l)
+        else:
+            executor = self._get_executor()
+            futures = [executor.submit(self._run, retrieve, l) for l in first_links]
+            for f in futures:
+                f.result()
+
+        for l in duplicate_links:
+            retrieve(l)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
@@ -0,0 +1,39 @@
+import os
+import threading
+from contextlib import contextmanager
+
+
+def get_temp_path(path: str) -> str:
+    """
+    Returns a temporary path next to path, unique to the calling thread, to write a file before renaming it.
+    """
+
+    return f"{path}.{os.getpid()}-{threading.get_ident()}.part"
+
+
+@contextmanager
+def atomic_path(path: str):
+    """
+    Yields a temporary path to write (or link) the new file at, renamed over path once the block
+    succeeds and removed otherwise. path is replaced atomically, and any other hardlink to the
+    previous file (eg. a stored body or a backup) is left untouched.
+    """
+
+    tmp_path = get_temp_path(path)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def replace_file_content(path: str, content, mode: str = "wb"):
+    """
+    Writes content to a new file then renames it over path, see atomic_path.
+    """
+
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, mode) as fp:
+            fp.write(content)
@@ -0,0 +1,124 @@
+import os
+import gzip
+import shutil
+import logging
+from typing import BinaryIO, Optional
+
+from atomic_file import atomic_path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Ways of keeping the original of a page or stylesheet before its links are remapped
+COPY = "copy"   # full copy of the downloaded file
+LINK = "link"   # hardlink to the downloaded file, the remapped file being written to a new file then renamed over it
+GZIP = "gzip"   # gzip compressed copy
+ZSTD = "zstd"   # zstd compressed copy, requires zstandard
+NONE = "none"   # no backup, the original can't be read back once remapped
+
+BACKUP_EXTENSIONS = {
+    COPY: ".orig",
+    LINK: ".orig",
+    GZIP: ".orig.gz",
+    ZSTD: ".orig.zst",
+}
+
+
+def get_backup_paths(path: str):
+    return [path + extension for extension in dict.fromkeys(BACKUP_EXTENSIONS.values())]
+
+
+def find_backup(path: str) -> Optional[str]:
+    """
+    Returns the path of the backup of the file at path, whatever the strategy it was written with.
+    """
+
+    for backup_path in get_backup_paths(path):
+        if os.path.isfile(backup_path):
+            return backup_path
+    return None
+
+
+def remove_backups(path: str, keep: str = None):
+    for backup_path in get_backup_paths(path):
+        if backup_path != keep and os.path.exists(backup_path):
+            os.remove(backup_path)
+
+
+def write_backup(path: str, strategy: str = LINK, overwrite: bool = False) -> Optional[str]:
+    """
+    Backs up the original of the file at path before it gets remapped, returns the path of the backup.
+    An existing backup is kept unless overwrite is set (when the resource has changed since it was archived).
+    """
+
+    if strategy == NONE or not os.path.isfile(path):
+        return None
+
+    existing_path = find_backup(path)
+    if existing_path is not None and not overwrite:
+        return existing_path
+
+    if strategy == ZSTD and zstandard is None:
+        raise ImportError("zstd backups require zstandard")
+
+    backup_path = path + BACKUP_EXTENSIONS[strategy]
+
+    with atomic_path(backup_path) as tmp_path:
+        if strategy == LINK:
+            try:
+                os.link(path, tmp_path)
+            except OSError as err:
+                logging.warning(f"Can't link backup of {path}, copying it: {err}")
+                shutil.copyfile(path, tmp_path)
+
+        elif strategy == COPY:
+            shutil.copyfile(path, tmp_path)
+
+        else:
+            with open(path, "rb") as src, open(tmp_path, "wb") as dst:
+                if strategy == GZIP:
+                    with gzip.GzipFile(fileobj=dst, mode="wb", compresslevel=6) as gz:
+                        shutil.copyfileobj(src, gz)
+                else:
+                    zstandard.ZstdCompressor().copy_stream(src, dst)
+
+    # A backup written with another strategy is now outdated
+    remove_backups(path, keep=backup_path)
+
+    return backup_path
+
+
+def is_compressed(backup_path: str) -> bool:
+    return backup_path.endswith((".gz", ".zst"))
+
+
+def open_backup(backup_path: str) -> BinaryIO:
+    """
+    Opens the backup at backup_path for reading its original content in chunks, decompressing it if needed.
+    """
+
+    if backup_path.endswith(".gz"):
+        return gzip.open(backup_path, "rb")
+
+    if backup_path.endswith(".zst"):
+        if zstandard is None:
+            raise ImportError(f"Reading {backup_path} requires zstandard")
+        return zstandard.ZstdDecompressor().stream_reader(open(backup_path, "rb"))
+
+    return open(backup_path, "rb")
+
+
+def read_backup(path: str) -> Optional[bytes]:
+    """
+    Returns the original content of the file at path, None if it has no backup.
+    """
+
+    backup_path = find_backup(path)
+    if backup_path is None:
+        return None
+
+    with open_backup(backup_path) as fp:
+        return fp.read()
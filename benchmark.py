@@ -0,0 +1,180 @@
+import os
+import re
+import sys
+import json
+import logging
+import argparse
+import resource
+import tempfile
+import subprocess
+from collections import deque
+
+from synthetic_site import SyntheticSite
+
+
+MODES = ["sync", "async", "pool"]
+
+# Stages reported per function, in this order
+STAGES = ["crawl_page", "crawl_css", "parse_page", "parse_css", "remap_page", "remap_css",
+          "request", "download", "write_manifest", "rate_limit_wait"]
+
+# Relative slowdown of pages/sec reported as a regression by --compare
+REGRESSION_THRESHOLD = 0.1
+
+
+def run_crawl(mode: str, start_url: str):
+    """
+    Crawls the site at start_url in the current directory with the given engine, returns the metrics summary.
+    """
+
+    import skydump
+    import engine
+    from metrics import Metrics
+    from ratelimit import RateLimiter, HostRateLimit
+    from session import create_session
+
+    allow = [re.compile(r"127\.0\.0\.1")]
+    # The local server is not throttled, the benchmark measures the crawler
+    rate_limiter = RateLimiter(default=HostRateLimit(rate=100000, burst=100000))
+
+    skydump.METRICS = Metrics(report_interval=0)
+    skydump.SESSION = create_session(pool_maxsize=32)
+
+    def is_crawlable_page(rsc):
+        return rsc.type == "page" and skydump.is_crawl_allowed(rsc.remote_url, allow, [])
+
+    if mode == "sync":
+        skydump.RATE_LIMITER = rate_limiter
+
+        queue = deque([start_url])
+        seen = {start_url}
+        while queue:
+            page = skydump.crawl_page(queue.popleft(), allow, [])
+            for l in page.links:
+                if is_crawlable_page(l.resource) and l.resource.remote_url not in seen:
+                    seen.add(l.resource.remote_url)
+                    queue.append(l.resource.remote_url)
+
+        skydump.MANIFEST_WRITER.flush()
+
+    else:
+        parse_pool = engine.ParsePool() if mode == "pool" else None
+        crawler = engine.AsyncCrawler(allow, [], rate_limiter=rate_limiter, session=skydump.SESSION, parse_pool=parse_pool)
+
+        try:
+            engine.asyncio.run(crawler.crawl([start_url], is_crawlable_page))
+        finally:
+            crawler.executor.shutdown()
+            if parse_pool is not None:
+                parse_pool.shutdown()
+
+    summary = skydump.METRICS.summary()
+    summary["peak_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    # Largest parse pool worker
+    summary["peak_rss_workers"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+
+    return summary
+
+
+def run_mode(mode: str, start_url: str) -> dict:
+    # Each mode runs in its own process and directory, for a cold start and its own peak RSS
+    with tempfile.TemporaryDirectory(prefix=f"skydump-bench-{mode}-") as work_dir:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", mode, start_url],
+                                cwd=work_dir, stdout=subprocess.PIPE, check=True,
+                                env={**os.environ, "PYTHONPATH": os.path.dirname(os.path.abspath(__file__))})
+
+    return json.loads(output.stdout.decode("utf-8").strip().splitlines()[-1])
+
+
+def format_report(mode: str, summary: dict) -> str:
+    lines = [f"== {mode}: {summary['pages']} pages in {summary['elapsed']:.2f}s, "
+             f"{summary['pages_per_sec']:.1f} pages/s, {summary['bytes_per_sec'] / 1024 / 1024:.2f} MiB/s, "
+             f"peak RSS {summary['peak_rss'] / 1024 / 1024:.0f} MiB"
+             + (f" (workers {summary['peak_rss_workers'] / 1024 / 1024:.0f} MiB)" if summary["peak_rss_workers"] else "")]
+
+    timers = summary["timers"]
+    for name in STAGES + sorted(set(timers) - set(STAGES)):
+        if name in timers:
+            t = timers[name]
+            lines.append(f"   {name:<16} {t['count']:>7} calls  wall {t['wall']:8.3f}s  cpu {t['cpu']:8.3f}s  "
+                         f"max {t['max'] * 1000:8.1f}ms")
+
+    if mode == "pool":
+        lines.append("   cpu times exclude the parse pool workers, extracting and remapping the links")
+
+    return "\n".join(lines)
+
+
+def compare(results: dict, previous: dict, threshold: float = REGRESSION_THRESHOLD) -> bool:
+    """
+    Prints the throughput of every mode against the previous results, returns False on a regression.
+    """
+
+    ok = True
+    for mode, summary in results.items():
+        if mode not in previous:
+            continue
+
+        before = previous[mode]["pages_per_sec"]
+        after = summary["pages_per_sec"]
+        change = (after - before) / before if before else 0.0
+
+        regression = change < -threshold
+        ok = ok and not regression
+        print(f"{mode}: {before:.1f} -> {after:.1f} pages/s ({change:+.0%}){' REGRESSION' if regression else ''}")
+
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline crawl benchmark against a synthetic Skyrock-like site")
+    parser.add_argument("--modes", default=",".join(MODES), help="comma separated engines among " + ", ".join(MODES))
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--articles", type=int, default=5, help="articles per page")
+    parser.add_argument("--assets", type=int, default=4, help="images per article")
+    parser.add_argument("--asset-size", type=int, default=20000)
+    parser.add_argument("--padding", type=int, default=20000, help="bytes of text per page")
+    parser.add_argument("--css-files", type=int, default=2)
+    parser.add_argument("--css-urls", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per request")
+    parser.add_argument("--output", help="json file to save the results to")
+    parser.add_argument("--compare", help="json results of a previous run, exits with 1 on a regression")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="relative slowdown reported as a regression")
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "URL"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        logging.getLogger().setLevel(logging.WARNING)
+        print(json.dumps(run_crawl(*args.child)))
+        return
+
+    site = SyntheticSite(pages=args.pages,
+                         articles_per_page=args.articles,
+                         assets_per_article=args.assets,
+                         asset_size=args.asset_size,
+                         page_padding=args.padding,
+                         css_files=args.css_files,
+                         css_urls=args.css_urls,
+                         latency=args.latency)
+    site.start()
+
+    results = {}
+    try:
+        for mode in args.modes.split(","):
+            results[mode] = run_mode(mode, site.url + "/")
+            print(format_report(mode, results[mode]), flush=True)
+    finally:
+        site.stop()
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(results, fp, indent=4)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            if not compare(results, json.load(fp), args.threshold):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import re
+import logging
+import threading
+from typing import List, Set
+
+from models.page import Page
+
+from skydump import REG_BLOG, REG_PAGE, RESOURCE_REGISTRY, normalize_url
+
+
+class BlogSeeder:
+    """
+    Predicts the paginated pages of a blog from its pagination, so they are queued at once instead of
+    being discovered one page after the other: the first listing page of a blog crawled (its root or
+    any /N.html page) gives the number of its last page, and /2.html to /N.html are returned to be queued.
+
+    Articles have opaque ids in their permalinks and can't be predicted, they are found on the
+    paginated pages, which are now all crawled in parallel.
+
+    Each blog is only seeded once per run, the frontier or the crawl loop dedups the pages also
+    found through the links.
+
+    blog_pattern: regex matching the domain of a blog
+    max_pages: bound on the number of pages seeded per blog, against a bogus page number
+    """
+
+    def __init__(self, blog_pattern: re.Pattern = REG_BLOG, max_pages: int = 10000):
+        self.blog_pattern = blog_pattern
+        self.max_pages = max_pages
+
+        self._seeded: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def is_listing_page(self, page: Page) -> bool:
+        path = normalize_url(page.remote_url).path
+        return not path or path == "/" or REG_PAGE.fullmatch(path) is not None
+
+    def get_last_page(self, page: Page) -> int:
+        last_page = 1
+
+        for l in page.links:
+            url = normalize_url(l.resource.remote_url)
+            if l.resource.type != "page" or url.domain != page.domain or not url.path:
+                continue
+
+            res = REG_PAGE.fullmatch(url.path)
+            if res is not None:
+                last_page = max(last_page, int(res.group(1)))
+
+        return min(last_page, self.max_pages)
+
+    def seed(self, page: Page) -> List[Page]:
+        """
+        Returns the paginated pages of the blog of page if it hasn't been seeded yet, an empty list otherwise.
+        """
+
+        if not page.domain or self.blog_pattern.search(page.domain) is None or not self.is_listing_page(page):
+            return []
+
+        with self._lock:
+            if page.domain in self._seeded:
+                return []
+            self._seeded.add(page.domain)
+
+        last_page = self.get_last_page(page)
+        if last_page > 1:
+            logging.info(f"Seeding pages 2 to {last_page} of blog {page.domain}")
+
+        return [RESOURCE_REGISTRY.placeholder(Page, f"{page.protocol}{page.domain}/{n}.html", page.protocol, page.domain)
+                for n in range(2, last_page + 1)]
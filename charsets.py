@@ -0,0 +1,124 @@
+import re
+import codecs
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+# Detector used by requests for Response.apparent_encoding (chardet or charset_normalizer)
+from requests.compat import chardet
+
+
+REG_HEADER_CHARSET = re.compile(r"charset\s*=\s*[\"']?([a-zA-Z0-9_\-:.]+)", re.I)
+REG_META_CHARSET = re.compile(rb"<meta[^>]+charset\s*=\s*[\"']?([a-zA-Z0-9_\-:.]+)", re.I)
+REG_CSS_CHARSET = re.compile(rb'^\s*@charset\s+["\']([a-zA-Z0-9_\-:.]+)["\']', re.I)
+
+
+def normalize_charset(charset: str) -> Optional[str]:
+    """
+    Returns the python codec name of charset, None if it is unknown.
+    """
+
+    if not charset:
+        return None
+
+    try:
+        return codecs.lookup(charset.strip()).name
+    except LookupError:
+        return None
+
+
+def is_decodable(body: bytes, encoding: str) -> bool:
+    try:
+        body.decode(encoding)
+        return True
+    except (UnicodeDecodeError, LookupError):
+        return False
+
+
+def get_declared_charset(body: bytes, header_content_type: str = None, sample_size: int = 4096) -> Optional[str]:
+    """
+    Returns the charset declared by the Content-Type header, else by the <meta> or @charset
+    at the start of the document, None if there is none.
+    """
+
+    if header_content_type:
+        res = REG_HEADER_CHARSET.search(header_content_type)
+        if res and normalize_charset(res.group(1)):
+            return normalize_charset(res.group(1))
+
+    sample = body[:sample_size]
+    for reg in (REG_META_CHARSET, REG_CSS_CHARSET):
+        res = reg.search(sample)
+        if res and normalize_charset(res.group(1).decode("ascii")):
+            return normalize_charset(res.group(1).decode("ascii"))
+
+    return None
+
+
+class CharsetDetector:
+    """
+    Decides the encoding of the downloaded text documents: the charset declared by the Content-Type
+    header or the document itself is used first, then the encoding last decided for the same host and
+    content type (the pages of a blog share their template), the statistical detection only running
+    on a sample of the document when none of them can decode it. A document decoding as utf-8 is
+    taken as utf-8 before looking at the cache: other encodings hardly ever give valid utf-8.
+
+    sample_size: number of bytes given to the detection
+    cache_size: number of hosts and content types whose encoding is kept
+    """
+
+    def __init__(self, sample_size: int = 16384, cache_size: int = 4096):
+        self.sample_size = sample_size
+        self.cache_size = cache_size
+
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, key, encoding: str):
+        with self._lock:
+            self._cache[key] = encoding
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def detect(self, body: bytes) -> Optional[str]:
+        sample = body[:self.sample_size]
+        # Don't give the detection a character cut in half
+        if len(sample) < len(body):
+            for _ in range(3):
+                if not sample or not sample[-1] & 0x80:
+                    break
+                sample = sample[:-1]
+
+        result = chardet.detect(sample)
+        return normalize_charset(result.get("encoding") if result else None)
+
+    def decide(self, body: bytes, header_content_type: str = None, domain: str = None, content_type: str = None) -> Optional[str]:
+        """
+        Returns the encoding the body can be decoded with, None if it isn't text in any known encoding.
+        """
+
+        key = (domain, content_type)
+
+        encoding = get_declared_charset(body, header_content_type)
+        if encoding is not None and is_decodable(body, encoding):
+            self._remember(key, encoding)
+            return encoding
+
+        if is_decodable(body, "utf-8"):
+            return "utf-8"
+
+        with self._lock:
+            encoding = self._cache.get(key)
+
+        if encoding is not None and is_decodable(body, encoding):
+            return encoding
+
+        encoding = self.detect(body)
+        if encoding is not None and is_decodable(body, encoding):
+            logging.info(f"Detected encoding {encoding} for {domain} {content_type}")
+            self._remember(key, encoding)
+            return encoding
+
+        return None
@@ -0,0 +1,85 @@
+import os
+import hashlib
+import logging
+
+from atomic_file import atomic_path
+
+
+class ContentStore:
+    """
+    Content-addressed storage of downloaded bodies: every distinct body is stored once under
+    its digest, and the files of the mirror are hardlinks to these objects. Identical assets
+    served under different urls (eg. query string variants) then share the same inode.
+
+    root: directory of the objects, must be on the same filesystem as the mirror
+    algorithm: hashlib algorithm used to compute the digests
+    """
+
+    def __init__(self, root: str = "_objects", algorithm: str = "sha256"):
+        self.root = root
+        self.algorithm = algorithm
+
+    def new_hash(self):
+        return hashlib.new(self.algorithm)
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def has(self, digest: str) -> bool:
+        return bool(digest) and os.path.exists(self.object_path(digest))
+
+    def _link(self, object_path: str, path: str):
+        # Linking to a temporary name then renaming replaces path atomically
+        with atomic_path(path) as tmp_path:
+            os.link(object_path, tmp_path)
+
+        # rename() does nothing if path already is a link to the object, leaving the temporary link behind
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    def add(self, path: str, digest: str) -> bool:
+        """
+        Stores the file at path under digest. If the same body is already stored,
+        path is replaced by a link to it. Returns False if the filesystem doesn't support it.
+        """
+
+        object_path = self.object_path(digest)
+
+        try:
+            if not os.path.exists(object_path):
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                try:
+                    os.link(path, object_path)
+                    return True
+                except FileExistsError:
+                    # Stored in the meantime by another download of the same body
+                    pass
+
+            if not os.path.samefile(object_path, path):
+                logging.info(f"Body of {path} already stored as {digest}, linking it")
+                self._link(object_path, path)
+
+        except OSError as err:
+            logging.warning(f"Can't link {path} in content store {self.root}: {err}")
+            return False
+
+        return True
+
+    def restore(self, digest: str, path: str) -> bool:
+        """
+        Recreates the file at path from the stored object of digest, without downloading it again.
+        Returns False if the body is not stored.
+        """
+
+        if not self.has(digest):
+            return False
+
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._link(self.object_path(digest), path)
+        except OSError as err:
+            logging.warning(f"Can't restore {path} from content store {self.root}: {err}")
+            return False
+
+        logging.info(f"Restored {path} from stored body {digest}")
+        return True
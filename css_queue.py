@@ -0,0 +1,90 @@
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Set
+
+
+class CssQueue:
+    """
+    Background queue crawling the stylesheets linked by the pages off their critical path: a page is
+    remapped and completed as soon as its stylesheets are downloaded, their own links being retrieved
+    and remapped here afterwards. Each stylesheet is only processed once per run, however many pages
+    link to it.
+
+    finalize() must be called before the end of the crawl (and may be called at checkpoints): the
+    stylesheets still queued at exit can't use the asset fetcher any more. Stylesheets left incomplete
+    by a killed crawl are processed by the next crawl linking them, or queued again by submit_incomplete().
+
+    crawl_css: fn(url) crawling a stylesheet, skydump.crawl_css
+    max_workers: number of stylesheets processed at the same time
+    """
+
+    def __init__(self, crawl_css: Callable[[str], object], max_workers: int = 2):
+        self.crawl_css = crawl_css
+        self.max_workers = max_workers
+
+        self._executor = None
+        self._futures: Dict[str, Future] = {}
+        # Stylesheets already waited for by finalize()
+        self._finalized: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="css_queue")
+        return self._executor
+
+    def submit(self, url: str):
+        """
+        Queues the stylesheet at url, unless it has already been queued during this run.
+        """
+
+        with self._lock:
+            if url not in self._futures:
+                self._futures[url] = self._get_executor().submit(self.crawl_css, url)
+
+    def submit_incomplete(self, manifests: Iterable[dict]):
+        """
+        Queues the stylesheets whose manifests (eg. manifest_index.iter_manifests) are incomplete.
+        """
+
+        for data in manifests:
+            if data.get("content_type") == "text/css" and not data.get("complete", False):
+                self.submit(data["remote_url"])
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(1 for f in self._futures.values() if not f.done())
+
+    def finalize(self) -> int:
+        """
+        Waits until every queued stylesheet is processed, returns how many have failed.
+        Failed stylesheets are forgotten, to be queued again by the next page linking them.
+        """
+
+        n_done = 0
+        n_errors = 0
+
+        # Pages crawled meanwhile may still be queuing stylesheets
+        while True:
+            with self._lock:
+                futures = [(url, f) for url, f in self._futures.items() if url not in self._finalized]
+            if not futures:
+                break
+
+            for url, f in futures:
+                try:
+                    f.result()
+                except Exception as err:
+                    logging.exception(f"Error while crawling stylesheet {url}: {err}")
+                    n_errors += 1
+                    with self._lock:
+                        del self._futures[url]
+                else:
+                    n_done += 1
+                    with self._lock:
+                        self._finalized.add(url)
+
+        logging.info(f"Finalized {n_done} stylesheets, {n_errors} errors")
+
+        return n_errors
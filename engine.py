@@ -0,0 +1,491 @@
+import re
+import time
+import asyncio
+import weakref
+import logging
+import contextlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List
+
+import requests
+
+from models.link import Link
+from models.page import Page
+from models.resource import Resource
+
+from frontier import Frontier
+from ratelimit import RateLimiter
+from parse_pool import ParsePool
+from blog_seeder import BlogSeeder
+from seen_set import SeenSet
+
+import skydump
+
+from skydump import ASSET_POST_PROCESSORS, MAX_RETRIES, REVALIDATED_URLS
+from skydump import fetch, normalize_url, parse_page, parse_css, load_resource, store_resource, read_original
+from skydump import resolve_link, store_link, post_process_page, post_process_css
+from skydump import get_conditional_headers, is_not_modified
+
+
+# Thread CPU times of the executor calls made for the page or stylesheet being crawled, see AsyncCrawler._timed
+_CPU_TIMES: contextvars.ContextVar = contextvars.ContextVar("cpu_times", default=None)
+
+
+def _call_timed(cpu_times: list, fn, *args):
+    start = time.thread_time()
+    try:
+        return fn(*args)
+    finally:
+        cpu_times.append(time.thread_time() - start)
+
+
+class HostLimits:
+    """
+    Bounds the number of requests in flight, globally and per host.
+
+    max_concurrency: maximum number of requests in flight over all hosts
+    per_host_concurrency: maximum number of requests in flight on the same host
+    host_concurrency: per host overrides of per_host_concurrency, keyed by domain
+    """
+
+    def __init__(self,
+                 max_concurrency: int = 16,
+                 per_host_concurrency: int = 4,
+                 host_concurrency: Dict[str, int] = None):
+        self.max_concurrency = max_concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.host_concurrency = host_concurrency or {}
+
+        self._global_semaphore = None
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def host_semaphore(self, domain: str) -> asyncio.Semaphore:
+        if domain not in self._host_semaphores:
+            limit = self.host_concurrency.get(domain, self.per_host_concurrency)
+            self._host_semaphores[domain] = asyncio.Semaphore(limit)
+        return self._host_semaphores[domain]
+
+    def global_semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it is bound to the running event loop
+        if self._global_semaphore is None:
+            self._global_semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._global_semaphore
+
+
+class AsyncCrawler:
+    """
+    Asynchronous alternative to the crawl_page/crawl_css loop: pages, stylesheets and
+    their assets are fetched concurrently, the blocking requests calls and disk writes
+    being run in a thread pool.
+
+    allow_crawl_conditions: list of regexes that must match to allow the link to be entered
+    forbid_crawl_conditions: list of regexes that must NOT match to allow the link to be entered
+    limits: concurrency limits applied to every request
+    rate_limiter: per host politeness, skydump.RATE_LIMITER (shared with the synchronous crawl) by default
+    session: pooled session used for every request, the shared skydump session by default
+             (its per host pool size should be at least the per host concurrency)
+    revalidate: refresh already archived pages and resources, only downloading again what has changed
+    parse_pool: process pool extracting and remapping the links, in the executor threads if not given
+    lazy_css: complete the pages without waiting for their stylesheets to be crawled, which are
+              waited for at the end of the crawl
+    """
+
+    def __init__(self,
+                 allow_crawl_conditions: List[re.Pattern] = list(),
+                 forbid_crawl_conditions: List[re.Pattern] = list(),
+                 limits: HostLimits = None,
+                 rate_limiter: RateLimiter = None,
+                 session: requests.Session = None,
+                 revalidate: bool = False,
+                 parse_pool: ParsePool = None,
+                 lazy_css: bool = False):
+        self.allow_crawl_conditions = allow_crawl_conditions
+        self.forbid_crawl_conditions = forbid_crawl_conditions
+        self.limits = limits or HostLimits()
+        self.rate_limiter = rate_limiter or skydump.RATE_LIMITER
+        self.session = session
+        self.revalidate = revalidate
+        self.parse_pool = parse_pool
+        self.lazy_css = lazy_css
+
+        self._parse_page = parse_pool.parse_page if parse_pool else parse_page
+        self._parse_css = parse_pool.parse_css if parse_pool else parse_css
+        self._rewrite_page = parse_pool.rewrite_page if parse_pool else None
+        self._rewrite_css = parse_pool.rewrite_css if parse_pool else None
+
+        self.executor = ThreadPoolExecutor(max_workers=self.limits.max_concurrency)
+        self._css_tasks: Dict[str, asyncio.Task] = {}
+        self._css_errors = 0
+        self._asset_tasks: Dict[str, asyncio.Task] = {}
+        self._url_locks = weakref.WeakValueDictionary()
+
+    async def _run(self, fn, *args):
+        cpu_times = _CPU_TIMES.get()
+        if cpu_times is not None:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, _call_timed, cpu_times, fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def _timed(self, name: str, coro):
+        """
+        Awaits coro, recording under name in skydump.METRICS its wall time and, as its CPU time,
+        the thread CPU time of the executor calls it makes: the event loop thread is shared by every
+        coroutine. Tasks started by coro (eg. the download of a shared asset) are counted with it.
+        """
+
+        if not skydump.METRICS.enabled:
+            return await coro
+
+        cpu_times = []
+        token = _CPU_TIMES.set(cpu_times)
+        start = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            _CPU_TIMES.reset(token)
+            skydump.METRICS.add_time(name, time.perf_counter() - start, sum(cpu_times))
+
+    def _lock(self, url: str) -> asyncio.Lock:
+        """
+        Returns the lock guarding the manifest and file of url, so a page being crawled
+        and the same url being downloaded as an asset never write over each other.
+        Locks are only held around disk operations, never while waiting on another url.
+        """
+
+        lock = self._url_locks.get(url)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._url_locks[url] = lock
+        return lock
+
+    @contextlib.asynccontextmanager
+    async def _slot(self, url: str):
+        """
+        Holds a global and a per host slot of the concurrency limits, from the request
+        until the response is read (streamed bodies included). The host slot is taken first,
+        so the requests waiting on a busy host don't hold the global slots of the other hosts.
+        """
+
+        domain = normalize_url(url).domain
+
+        async with self.limits.host_semaphore(domain), self.limits.global_semaphore():
+            yield
+
+    async def _fetch(self, url: str, stream=False, headers=None) -> requests.Response:
+        # Must be called holding a slot, see fetch
+        domain = normalize_url(url).domain
+
+        for attempt in range(MAX_RETRIES + 1):
+            with skydump.METRICS.timer("rate_limit_wait", cpu=False):
+                await self.rate_limiter.wait_async(domain)
+
+            response = await self._run(fetch, url, False, 0, self.session, stream, headers)
+
+            if not self.rate_limiter.handle_response(domain, response):
+                break
+
+            response.close()
+
+        return response
+
+    async def fetch(self, url: str, headers=None) -> requests.Response:
+        async with self._slot(url):
+            return await self._fetch(url, headers=headers)
+
+    async def _download_link(self, l: Link) -> Resource:
+        remote_url = l.resource.remote_url
+
+        try:
+            # The body is streamed to disk by store_link, in the executor, still within the limits
+            async with self._slot(remote_url):
+                response = await self._fetch(remote_url, stream=True)
+
+                try:
+                    async with self._lock(remote_url):
+                        # The url may have been stored in the meantime by the crawl of the page itself
+                        if not await self._run(resolve_link, l):
+                            l = await self._run(store_link, l, response)
+                finally:
+                    response.close()
+
+            return l.resource
+        finally:
+            # Once written, the manifest is enough for resolve_link to find the resource
+            del self._asset_tasks[remote_url]
+
+    async def _revalidate_link(self, l: Link):
+        remote_url = l.resource.remote_url
+
+        if remote_url in REVALIDATED_URLS:
+            return
+        REVALIDATED_URLS.add(remote_url)
+
+        # Post-processed documents are refreshed by crawling them again, see revalidate_link
+        if l.resource.complete:
+            if l.resource.content_type == "text/css":
+                l.resource = await self.crawl_css(remote_url)
+            return
+
+        async with self._slot(remote_url):
+            response = await self._fetch(remote_url, stream=True, headers=get_conditional_headers(l.resource))
+
+            try:
+                if not is_not_modified(l.resource, response):
+                    async with self._lock(remote_url):
+                        await self._run(store_link, l, response, True)
+            finally:
+                response.close()
+
+    async def _retrieve_links(self, rsc: Resource):
+        async def _retrieve(l):
+            async with self._lock(l.resource.remote_url):
+                resolved = await self._run(resolve_link, l)
+
+            if resolved:
+                if self.revalidate:
+                    await self._revalidate_link(l)
+                return
+
+            # An asset linked by several pages being crawled at the same time is only downloaded once
+            remote_url = l.resource.remote_url
+            if remote_url not in self._asset_tasks:
+                self._asset_tasks[remote_url] = asyncio.ensure_future(self._download_link(l))
+            l.resource = await self._asset_tasks[remote_url]
+
+        await asyncio.gather(*(_retrieve(l) for l in rsc.links))
+
+    def _css_task(self, url: str) -> asyncio.Task:
+        # A stylesheet shared by many pages is only crawled once
+        if url not in self._css_tasks:
+            task = asyncio.ensure_future(self._crawl_css(url))
+            task.add_done_callback(lambda t: self._css_task_done(url, t))
+            self._css_tasks[url] = task
+        return self._css_tasks[url]
+
+    def _css_task_done(self, url: str, task: asyncio.Task):
+        if task.cancelled() or task.exception() is None:
+            return
+
+        logging.error(f"Error while crawling stylesheet {url}: {task.exception()}")
+        self._css_errors += 1
+
+        # Crawled again by the next page linking it
+        if self._css_tasks.get(url) is task:
+            del self._css_tasks[url]
+
+    async def crawl_css(self, url: str) -> Resource:
+        return await self._css_task(url)
+
+    async def finalize_css(self) -> int:
+        """
+        Waits until every stylesheet crawled in the background (see lazy_css) is done, returns how many have failed.
+        """
+
+        while True:
+            pending = [t for t in self._css_tasks.values() if not t.done()]
+            if not pending:
+                break
+            await asyncio.wait(pending)
+
+        # Failed tasks are counted (and forgotten) by _css_task_done
+        n_errors, self._css_errors = self._css_errors, 0
+        return n_errors
+
+    async def _crawl_css(self, url: str) -> Resource:
+        return await self._timed("crawl_css", self._crawl_css_resource(url))
+
+    async def _crawl_css_resource(self, url: str) -> Resource:
+        async with self._lock(url):
+            css_rsc = await self._run(load_resource, url, Resource)
+
+        if not css_rsc.complete or self.revalidate:
+            response = await self.fetch(css_rsc.remote_url,
+                                        headers=get_conditional_headers(css_rsc) if self.revalidate else None)
+
+            if is_not_modified(css_rsc, response):
+                if not css_rsc.complete:
+                    css_rsc = await self._run(self._parse_css, css_rsc, None, await self._run(read_original, css_rsc))
+            else:
+                css_rsc.complete = False
+                css_rsc = await self._run(self._parse_css, css_rsc, response)
+
+                async with self._lock(url):
+                    css_rsc = await self._run(store_resource, css_rsc, response, self.revalidate)
+
+        await self._retrieve_links(css_rsc)
+
+        if not css_rsc.complete:
+            async with self._lock(url):
+                css_rsc = await self._run(post_process_css, css_rsc, self._rewrite_css)
+
+        return css_rsc
+
+    async def crawl_page(self, url: str) -> Page:
+        page = await self._timed("crawl_page", self._crawl_page(url))
+        skydump.METRICS.count("pages")
+        return page
+
+    async def _crawl_page(self, url: str) -> Page:
+        async with self._lock(url):
+            page = await self._run(load_resource, url, Page)
+
+        if not page.complete or self.revalidate:
+            response = await self.fetch(page.remote_url,
+                                        headers=get_conditional_headers(page) if self.revalidate else None)
+
+            if is_not_modified(page, response):
+                if not page.complete:
+                    html_doc = await self._run(read_original, page)
+                    page = await self._run(self._parse_page, page, self.allow_crawl_conditions, self.forbid_crawl_conditions, None, html_doc)
+            else:
+                page.complete = False
+                page = await self._run(self._parse_page, page, self.allow_crawl_conditions, self.forbid_crawl_conditions, response)
+
+                async with self._lock(url):
+                    page = await self._run(store_resource, page, response, self.revalidate)
+
+        await self._retrieve_links(page)
+
+        if not page.complete:
+            # Stylesheets are crawled by the engine itself to go through the concurrency limits,
+            # the other asset post-processors are run as is
+            css_links = [l for l in page.links if l.resource.content_type == "text/css"]
+            css_tasks = [self._css_task(l.resource.remote_url) for l in css_links]
+
+            # The page only links to the stylesheet files, already downloaded, lazy ones are waited for by finalize_css()
+            if not self.lazy_css:
+                await asyncio.gather(*css_tasks)
+
+            for link in page.links:
+                if link.resource.content_type == "text/css":
+                    continue
+
+                for fn in ASSET_POST_PROCESSORS.get(link.resource.content_type, []):
+                    await self._run(fn, page, link)
+
+            async with self._lock(url):
+                page = await self._run(post_process_page, page, False, self._rewrite_page)
+
+        return page
+
+    async def crawl(self,
+                    start_urls: Iterable[str],
+                    page_filter: Callable[[Resource], bool] = None,
+                    workers: int = None,
+                    frontier: Frontier = None,
+                    seeder: BlogSeeder = None,
+                    seen: SeenSet = None) -> List[str]:
+        """
+        Crawls start_urls and every linked page accepted by page_filter.
+        Returns the list of crawled urls.
+
+        page_filter: called with each linked resource of type page, returns True to crawl it
+        workers: number of pages crawled simultaneously, defaults to the global concurrency limit
+        frontier: persistent frontier to dedup and record the crawled urls in, the urls it still
+                  has queued are crawled too
+        seeder: queues the paginated pages of each blog as soon as its first page is crawled
+        seen: urls already queued, to dedup the urls without a frontier, an in memory set by default
+        """
+
+        queue: asyncio.Queue = asyncio.Queue()
+        seen = seen if seen is not None else set()
+        crawled = []
+
+        def _enqueue(urls):
+            if frontier is None:
+                for url in urls:
+                    if url not in seen:
+                        seen.add(url)
+                        queue.put_nowait(url)
+            else:
+                # Every queued url is taken at once, the frontier only has to record what is done
+                while (url := frontier.pop()) is not None:
+                    queue.put_nowait(url)
+
+        if frontier is not None:
+            frontier.add(start_urls)
+        _enqueue(start_urls)
+
+        async def _worker():
+            while True:
+                url = await queue.get()
+                try:
+                    logging.info(f"---- GETTING PAGE {url} ----")
+                    page = await self.crawl_page(url)
+                    crawled.append(url)
+
+                    discovered_pages = [l.resource for l in page.links if l.resource.type == "page"]
+                    if seeder is not None:
+                        discovered_pages += seeder.seed(page)
+
+                    discovered_urls = [rsc.remote_url for rsc in discovered_pages
+                                       if page_filter is None or page_filter(rsc)]
+
+                    if frontier is not None:
+                        # The manifests of the page must be on disk before it is recorded as done
+                        await self._run(skydump.MANIFEST_WRITER.flush)
+                        frontier.done(url, discovered_urls)
+                    _enqueue(discovered_urls)
+
+                    skydump.METRICS.set_queue_depth(queue.qsize())
+                    skydump.METRICS.tick()
+
+                except Exception as err:
+                    logging.exception(f"Error while crawling page {url}: {err}")
+
+                finally:
+                    queue.task_done()
+
+        worker_tasks = [asyncio.ensure_future(_worker()) for _ in range(workers or self.limits.max_concurrency)]
+
+        await queue.join()
+        await self.finalize_css()
+        await self._run(skydump.MANIFEST_WRITER.flush)
+
+        for t in worker_tasks:
+            t.cancel()
+
+        await asyncio.gather(*worker_tasks, return_exceptions=True)
+
+        if skydump.METRICS.enabled:
+            skydump.METRICS.report()
+
+        return crawled
+
+
+def crawl(start_urls: Iterable[str],
+          allow_crawl_conditions: List[re.Pattern] = list(),
+          forbid_crawl_conditions: List[re.Pattern] = list(),
+          page_filter: Callable[[Resource], bool] = None,
+          max_concurrency: int = 16,
+          per_host_concurrency: int = 4,
+          session: requests.Session = None,
+          frontier: Frontier = None,
+          revalidate: bool = False,
+          parse_processes: int = 0,
+          seeder: BlogSeeder = None,
+          lazy_css: bool = False):
+    """
+    Synchronous entry point running an AsyncCrawler until every reachable page is crawled.
+
+    parse_processes: number of processes extracting and remapping the links, 0 to do it in the crawl threads
+    seeder: queues the paginated pages of each blog as soon as its first page is crawled
+    lazy_css: complete the pages without waiting for their stylesheets to be crawled
+    """
+
+    parse_pool = ParsePool(parse_processes) if parse_processes else None
+
+    crawler = AsyncCrawler(allow_crawl_conditions,
+                           forbid_crawl_conditions,
+                           HostLimits(max_concurrency, per_host_concurrency),
+                           session=session,
+                           revalidate=revalidate,
+                           parse_pool=parse_pool,
+                           lazy_css=lazy_css)
+
+    try:
+        return asyncio.run(crawler.crawl(start_urls, page_filter, frontier=frontier, seeder=seeder))
+    finally:
+        crawler.executor.shutdown()
+        if parse_pool is not None:
+            parse_pool.shutdown()
@@ -0,0 +1,176 @@
+import sys
+import logging
+from html.parser import HTMLParser
+from typing import Dict, List, Tuple
+
+from bs4 import BeautifulSoup, Tag
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+
+LINK_ATTRIBUTES = ["src", "href"]  # "content"
+
+# (tag name, {attribute: value}) of a tag holding at least one of LINK_ATTRIBUTES, in document order
+LinkTag = Tuple[str, Dict[str, str]]
+
+
+class LinkExtractor:
+    """
+    Extracts the tags holding links from an html document, for parse_page.
+    """
+
+    name = None
+
+    def extract(self, html_doc: str) -> List[LinkTag]:
+        raise NotImplementedError
+
+
+class SoupExtractor(LinkExtractor):
+    """
+    Reference implementation, building the whole BeautifulSoup tree of the document.
+    """
+
+    name = "soup"
+
+    def extract(self, html_doc: str) -> List[LinkTag]:
+        soup = BeautifulSoup(html_doc, 'html.parser')
+
+        def _predicate(t: Tag):
+            return any(map(t.has_attr, LINK_ATTRIBUTES))
+
+        link_tags = []
+        for t in soup.find_all(_predicate):
+            link_tags.append((t.name, {attr: t.get(attr) for attr in LINK_ATTRIBUTES if t.has_attr(attr)}))
+
+        return link_tags
+
+
+class _LinkTagParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.link_tags: List[LinkTag] = []
+
+    def handle_starttag(self, tag, attrs):
+        link_attrs = None
+
+        for attr, value in attrs:
+            if attr in LINK_ATTRIBUTES:
+                if link_attrs is None:
+                    link_attrs = {}
+                # Like BeautifulSoup: valueless attributes are empty, the last duplicate wins
+                link_attrs[attr] = value if value is not None else ""
+
+        if link_attrs is not None:
+            self.link_tags.append((tag, link_attrs))
+
+
+class TokenizerExtractor(LinkExtractor):
+    """
+    Streams the document through the html.parser tokenizer (the one BeautifulSoup uses with
+    'html.parser') and only looks at the attributes of start tags, without building any tree.
+    Gives the same tags as SoupExtractor.
+    """
+
+    name = "tokenizer"
+
+    def extract(self, html_doc: str) -> List[LinkTag]:
+        parser = _LinkTagParser()
+        parser.feed(html_doc)
+        parser.close()
+        return parser.link_tags
+
+
+class LxmlExtractor(LinkExtractor):
+    """
+    Uses the libxml2 html parser, the fastest backend. Requires lxml.
+    libxml2 recovers from broken markup differently than html.parser, so a few
+    tags may differ on malformed pages (see check_parity).
+    """
+
+    name = "lxml"
+
+    def __init__(self):
+        if lxml is None:
+            raise ImportError("LxmlExtractor requires lxml")
+
+    def extract(self, html_doc: str) -> List[LinkTag]:
+        if not html_doc.strip():
+            return []
+
+        try:
+            root = lxml.html.document_fromstring(html_doc)
+        except Exception as err:
+            logging.error(f"lxml can't parse document: {err}")
+            return []
+
+        link_tags = []
+        for t in root.xpath("//*[@src or @href]"):
+            link_tags.append((t.tag, {attr: t.get(attr) for attr in LINK_ATTRIBUTES if attr in t.attrib}))
+
+        return link_tags
+
+
+EXTRACTORS = {
+    SoupExtractor.name: SoupExtractor,
+    TokenizerExtractor.name: TokenizerExtractor,
+    LxmlExtractor.name: LxmlExtractor,
+}
+
+
+def get_extractor(name: str) -> LinkExtractor:
+    return EXTRACTORS[name]()
+
+
+def get_links(extractor: LinkExtractor, html_doc: str, url: str = "https://parity.skyrock.com/") -> List[Tuple[str, str, str]]:
+    """
+    Returns the (original url, remote url, type) of the links parse_page finds in html_doc with extractor.
+    """
+
+    import skydump
+    from models.page import Page
+
+    page = Page(remote_url=url, protocol="https://", domain=url.split("/")[2])
+    page = skydump.parse_page(page, html_doc=html_doc, extractor=extractor)
+    return [(l.original_url, l.resource.remote_url, l.resource.type) for l in page.links]
+
+
+def check_parity(paths: List[str], extractor_names: List[str], url: str = "https://parity.skyrock.com/") -> bool:
+    """
+    Parses the pages at paths (eg. saved .orig pages) with the reference extractor and with each
+    of extractor_names, and reports the pages whose Link list differ.
+    Returns True if every extractor yields the same links as the reference.
+    """
+
+    reference = SoupExtractor()
+    extractors = [get_extractor(name) for name in extractor_names]
+    identical = True
+
+    for path in paths:
+        with open(path, "rb") as fp:
+            html_doc = fp.read().decode("ISO-8859-1")
+
+        reference_links = get_links(reference, html_doc, url)
+
+        for extractor in extractors:
+            links = get_links(extractor, html_doc, url)
+            if links != reference_links:
+                identical = False
+                diff = [l for l in links if l not in reference_links] + [l for l in reference_links if l not in links]
+                print(f"{path}: {extractor.name} gives {len(links)} links, {reference.name} gives {len(reference_links)}, "
+                      f"first differences: {diff[:5]}")
+
+    return identical
+
+
+if __name__ == "__main__":
+    # python extractors.py tokenizer,lxml workspace/*/*.orig
+    if len(sys.argv) < 3:
+        print("Usage: python extractors.py <extractor>[,<extractor>...] <page> [<page>...]")
+        sys.exit(2)
+
+    identical = check_parity(sys.argv[2:], sys.argv[1].split(","))
+    print("All links identical" if identical else "Links differ")
+    sys.exit(0 if identical else 1)
@@ -0,0 +1,109 @@
+import sqlite3
+import logging
+from typing import Iterable, Optional
+
+from skydump import normalize_url
+
+
+QUEUED = 0
+IN_PROGRESS = 1
+DONE = 2
+
+
+class Frontier:
+    """
+    Crawl frontier persisted in a SQLite database: every url ever seen is stored once
+    (the primary key gives the dedup), along with its state and insertion order.
+    Urls left in progress by a killed crawl are queued again when the frontier is reopened.
+
+    path: path of the database file, ":memory:" for a throwaway frontier
+    """
+
+    def __init__(self, path: str = "frontier.db"):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS urls (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    url TEXT NOT NULL UNIQUE,
+                    domain TEXT NOT NULL,
+                    state INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            self.connection.execute("CREATE INDEX IF NOT EXISTS urls_state_domain ON urls (state, domain, seq)")
+
+            resumed = self.connection.execute("UPDATE urls SET state = ? WHERE state = ?", (QUEUED, IN_PROGRESS)).rowcount
+
+        if resumed:
+            logging.info(f"Resuming {resumed} urls left in progress in frontier {path}")
+
+    def close(self):
+        self.connection.close()
+
+    def _insert(self, urls: Iterable[str]) -> int:
+        rows = [(url, normalize_url(url).domain) for url in urls]
+
+        cursor = self.connection.executemany("INSERT OR IGNORE INTO urls (url, domain) VALUES (?, ?)", rows)
+        return cursor.rowcount
+
+    def add(self, urls: Iterable[str]) -> int:
+        """
+        Queues the urls never seen before, returns how many were added.
+        """
+
+        with self.connection:
+            return self._insert(urls)
+
+    def pop(self, domain: str = None) -> Optional[str]:
+        """
+        Takes the oldest queued url, from domain first if given, and marks it in progress.
+        Returns None when the frontier is empty.
+        """
+
+        row = None
+        if domain is not None:
+            row = self.connection.execute("SELECT seq, url FROM urls WHERE state = ? AND domain = ? ORDER BY seq LIMIT 1",
+                                          (QUEUED, domain)).fetchone()
+        if row is None:
+            row = self.connection.execute("SELECT seq, url FROM urls WHERE state = ? ORDER BY seq LIMIT 1",
+                                          (QUEUED,)).fetchone()
+        if row is None:
+            return None
+
+        with self.connection:
+            self.connection.execute("UPDATE urls SET state = ? WHERE seq = ?", (IN_PROGRESS, row[0]))
+
+        return row[1]
+
+    def done(self, url: str, discovered_urls: Iterable[str] = ()) -> int:
+        """
+        Marks url as crawled and queues the urls discovered on it in the same transaction,
+        returns how many new urls were queued.
+        """
+
+        with self.connection:
+            added = self._insert(discovered_urls)
+            self.connection.execute("UPDATE urls SET state = ? WHERE url = ?", (DONE, url))
+        return added
+
+    def requeue(self) -> int:
+        """
+        Queues again every crawled url (eg. to refresh the whole archive), returns how many were queued.
+        """
+
+        with self.connection:
+            return self.connection.execute("UPDATE urls SET state = ? WHERE state = ?", (QUEUED, DONE)).rowcount
+
+    def seen(self, url: str) -> bool:
+        return self.connection.execute("SELECT 1 FROM urls WHERE url = ?", (url,)).fetchone() is not None
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM urls WHERE state != ?", (DONE,)).fetchone()[0]
+
+    def __contains__(self, url: str):
+        return self.seen(url)
@@ -0,0 +1,153 @@
+import os
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterator, Optional, Tuple
+
+
+def iter_manifests(root: str = ".") -> Iterator[Tuple[str, dict]]:
+    """
+    Yields the path and the content of every resource manifest under root, the paths being
+    relative to the working directory as built by the crawler.
+    """
+
+    for dir_path, dir_names, file_names in os.walk(root):
+        for file_name in file_names:
+            if not file_name.endswith(".json"):
+                continue
+
+            path = os.path.relpath(os.path.join(dir_path, file_name))
+
+            try:
+                with open(path, "r") as fp:
+                    data = json.load(fp)
+            except (OSError, ValueError) as err:
+                logging.warning(f"Can't load manifest {path}: {err}")
+                continue
+
+            # Downloaded json resources are not manifests
+            if not isinstance(data, dict) or "remote_url" not in data or "type" not in data:
+                continue
+
+            yield path, data
+
+
+class ManifestIndex:
+    """
+    In memory index of the resource manifests written on disk.
+
+    For every manifest path it knows of, the index remembers whether the file it describes
+    has been downloaded, so checking a link against the archive costs no filesystem access.
+    The manifests themselves are kept in a LRU cache of their parsed content.
+    Every manifest written by write_resource_manifest goes through update().
+
+    cache_size: number of parsed manifests kept in memory
+    """
+
+    def __init__(self, cache_size: int = 4096):
+        self.cache_size = cache_size
+        self.scanned = False
+
+        # manifest path -> local_url of the downloaded file, None if not downloaded (yet)
+        self._downloaded: Dict[str, Optional[str]] = {}
+        # paths known to have no manifest
+        self._missing = set()
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cache_put(self, path: str, data: dict):
+        self._cache[path] = data
+        self._cache.move_to_end(path)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _register(self, path: str, data: dict):
+        local_url = data.get("local_url", "")
+        self._downloaded[path] = local_url if local_url and os.path.exists(local_url) else None
+        self._missing.discard(path)
+
+    def scan(self, root: str = "."):
+        """
+        Loads every manifest under root once. Afterwards, a path unknown to the index
+        is considered as having no manifest without probing the disk.
+        """
+
+        n_manifests = 0
+
+        for path, data in iter_manifests(root):
+            with self._lock:
+                self._register(path, data)
+            n_manifests += 1
+
+        self.scanned = True
+        logging.info(f"Indexed {n_manifests} manifests from {root}")
+
+    def load(self, path: str) -> Optional[dict]:
+        """
+        Returns the parsed content of the manifest at path, None if it doesn't exist.
+        The returned dict is shared with the cache and must not be modified.
+        """
+
+        path = os.path.normpath(path)
+
+        with self._lock:
+            if path in self._cache:
+                self._cache.move_to_end(path)
+                return self._cache[path]
+
+            if path in self._missing or (self.scanned and path not in self._downloaded):
+                return None
+
+        if not os.path.exists(path):
+            with self._lock:
+                self._missing.add(path)
+            return None
+
+        logging.info(f"Found resource manifest in {path}")
+
+        with open(path, "r") as fp:
+            data = json.load(fp)
+
+        with self._lock:
+            if path not in self._downloaded:
+                self._register(path, data)
+            self._cache_put(path, data)
+
+        return data
+
+    def update(self, path: str, data: dict):
+        """
+        Records the content of a manifest that has just been written at path.
+        """
+
+        path = os.path.normpath(path)
+
+        with self._lock:
+            self._register(path, data)
+            self._cache_put(path, data)
+
+    def discard(self, path: str):
+        """
+        Forgets the manifest at path, which has been removed from the disk.
+        """
+
+        path = os.path.normpath(path)
+
+        with self._lock:
+            self._downloaded.pop(path, None)
+            self._cache.pop(path, None)
+            self._missing.add(path)
+
+    def get_local_url(self, path: str) -> Optional[str]:
+        """
+        Returns the local url of the downloaded file described by the manifest at path,
+        None if there's no manifest or if the file has not been downloaded.
+        """
+
+        path = os.path.normpath(path)
+
+        if path not in self._downloaded and path not in self._missing and not self.scanned:
+            self.load(path)
+
+        return self._downloaded.get(path)
@@ -0,0 +1,109 @@
+import os
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from atomic_file import replace_file_content
+
+
+class ManifestWriter:
+    """
+    Writes the resource manifests on disk, either right away or through a write-behind buffer.
+
+    Buffered manifests are coalesced (a manifest written several times while buffered is only
+    written once, with its last content) and written in batches, when the buffer is full or on
+    flush(). Every manifest is written to a temporary file then renamed, so a crash never leaves
+    a truncated manifest: at worst the last buffered manifests are lost and their resources are
+    downloaded again. Call flush() before recording a page as done (see Frontier.done).
+
+    batch_size: number of buffered manifests triggering a flush, 0 to write every manifest immediately
+    compact: write minified json instead of indented json
+    """
+
+    def __init__(self, batch_size: int = 0, compact: bool = False):
+        self.batch_size = batch_size
+        self.compact = compact
+
+        self._pending: Dict[str, dict] = OrderedDict()
+        # Manifests taken from the buffer by the flush in progress, still readable through get()
+        self._flushing: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def dumps(self, data: dict) -> str:
+        if self.compact:
+            return json.dumps(data, separators=(",", ":"))
+        return json.dumps(data, indent=4)
+
+    def _write_file(self, path: str, data: dict):
+        replace_file_content(path, self.dumps(data), "w")
+
+    def write(self, path: str, data: dict):
+        if self.batch_size <= 0:
+            self._write_file(path, data)
+            return
+
+        path = os.path.normpath(path)
+
+        with self._lock:
+            self._pending[path] = data
+            is_full = len(self._pending) >= self.batch_size
+
+        if is_full:
+            self.flush()
+
+    def get(self, path: str) -> Optional[dict]:
+        """
+        Returns the content of the manifest at path if it is still buffered, None otherwise.
+        """
+
+        path = os.path.normpath(path)
+
+        with self._lock:
+            data = self._pending.get(path)
+            if data is None:
+                data = self._flushing.get(path)
+            return data
+
+    def discard(self, path: str):
+        """
+        Drops the buffered manifest at path, if any, so it is not written.
+        """
+
+        path = os.path.normpath(path)
+
+        with self._lock:
+            self._pending.pop(path, None)
+
+    def flush(self):
+        """
+        Writes every buffered manifest on disk.
+        """
+
+        # Flushes are serialized so an older content never overwrites a newer one
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                self._flushing = self._pending
+                self._pending = OrderedDict()
+
+            logging.info(f"Flushing {len(self._flushing)} manifests")
+
+            written = set()
+            try:
+                for path, data in self._flushing.items():
+                    self._write_file(path, data)
+                    written.add(path)
+            finally:
+                with self._lock:
+                    # Manifests not written because of an error are buffered again, unless rewritten since
+                    for path, data in self._flushing.items():
+                        if path not in written and path not in self._pending:
+                            self._pending[path] = data
+                    self._flushing = {}
+
+    def __len__(self):
+        return len(self._pending)
@@ -0,0 +1,144 @@
+import json
+import time
+import logging
+import threading
+from collections import defaultdict
+from contextlib import nullcontext
+from typing import Dict
+
+
+_DISABLED_TIMER = nullcontext()
+
+
+class _Timer:
+    __slots__ = ("metrics", "name", "cpu", "start", "cpu_start")
+
+    def __init__(self, metrics: "Metrics", name: str, cpu: bool = True):
+        self.metrics = metrics
+        self.name = name
+        self.cpu = cpu
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.cpu_start = time.thread_time() if self.cpu else 0.0
+        return self
+
+    def __exit__(self, *exc_info):
+        cpu_time = time.thread_time() - self.cpu_start if self.cpu else 0.0
+        self.metrics.add_time(self.name, time.perf_counter() - self.start, cpu_time)
+
+
+class Metrics:
+    """
+    Timers, counters and throughput of a crawl.
+
+    Timers record the wall time and the CPU time of the thread they run in, so the time spent
+    in a stage (eg. parse_page) is known whatever thread or engine runs it. Coroutines share
+    the thread of the event loop: their timers are started with cpu=False and only record wall time,
+    except crawl_page/crawl_css whose CPU time is summed from their executor calls by the async
+    engine (see engine.AsyncCrawler._timed). Counters count events
+    (pages, requests, links...), bytes are counted per host. A summary is logged every
+    report_interval seconds of crawl (see tick) and appended as a json line to export_path.
+
+    When disabled, timer() returns a shared no-op context manager and every other call returns
+    at once, so the instrumentation can stay in place.
+
+    enabled: record anything at all
+    report_interval: seconds between two summaries, 0 to only report on demand
+    export_path: json lines file the summaries are appended to
+    """
+
+    def __init__(self, enabled: bool = True, report_interval: float = 30, export_path: str = None):
+        self.enabled = enabled
+        self.report_interval = report_interval
+        self.export_path = export_path
+
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.start_time = time.monotonic()
+            self.next_report_time = self.start_time + self.report_interval
+            self.timers: Dict[str, list] = defaultdict(lambda: [0, 0.0, 0.0, 0.0])  # count, wall, cpu, max wall
+            self.counters: Dict[str, int] = defaultdict(int)
+            self.host_bytes: Dict[str, int] = defaultdict(int)
+            self.queue_depth = 0
+
+    def timer(self, name: str, cpu: bool = True):
+        if not self.enabled:
+            return _DISABLED_TIMER
+        return _Timer(self, name, cpu)
+
+    def add_time(self, name: str, wall_time: float, cpu_time: float = 0.0):
+        with self._lock:
+            timer = self.timers[name]
+            timer[0] += 1
+            timer[1] += wall_time
+            timer[2] += cpu_time
+            timer[3] = max(timer[3], wall_time)
+
+    def count(self, name: str, n: int = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] += n
+
+    def add_bytes(self, domain: str, n_bytes: int):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.host_bytes[domain] += n_bytes
+
+    def set_queue_depth(self, depth: int):
+        self.queue_depth = depth
+
+    def summary(self) -> dict:
+        with self._lock:
+            elapsed = time.monotonic() - self.start_time
+            total_bytes = sum(self.host_bytes.values())
+
+            return {
+                "time": time.time(),
+                "elapsed": elapsed,
+                "pages": self.counters.get("pages", 0),
+                "pages_per_sec": self.counters.get("pages", 0) / elapsed if elapsed else 0.0,
+                "bytes": total_bytes,
+                "bytes_per_sec": total_bytes / elapsed if elapsed else 0.0,
+                "queue_depth": self.queue_depth,
+                "counters": dict(self.counters),
+                "host_bytes": dict(self.host_bytes),
+                "timers": {name: {"count": count, "wall": wall, "cpu": cpu, "max": max_wall}
+                           for name, (count, wall, cpu, max_wall) in self.timers.items()},
+            }
+
+    def report(self) -> dict:
+        """
+        Logs a summary of the crawl so far and appends it to export_path.
+        """
+
+        summary = self.summary()
+
+        timers = ", ".join(f"{name} {t['wall']:.2f}s/{t['count']}" for name, t in
+                           sorted(summary["timers"].items(), key=lambda item: -item[1]["wall"]))
+        logging.info(f"{summary['pages']} pages in {summary['elapsed']:.0f}s ({summary['pages_per_sec']:.2f} pages/s, "
+                     f"{summary['bytes_per_sec'] / 1024:.0f} KiB/s), {summary['queue_depth']} queued, time in {timers}")
+
+        if self.export_path:
+            with open(self.export_path, "a") as fp:
+                fp.write(json.dumps(summary) + "\n")
+
+        return summary
+
+    def tick(self):
+        """
+        Called by the crawl loops after every page, reports when the report interval has elapsed.
+        """
+
+        if not self.enabled or not self.report_interval:
+            return
+
+        now = time.monotonic()
+        if now >= self.next_report_time:
+            self.next_report_time = now + self.report_interval
+            self.report()
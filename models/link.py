@@ -1,20 +1,24 @@
 from dataclasses import dataclass, field
-from .resource import Resource
+from .resource import Resource, intern_str
 
 
-@dataclass
+@dataclass(slots=True)
 class Link:
     origin: str = field(default="")
     original_url: str = field(default="")
     resource: Resource = field(default=None)
 
+    def __post_init__(self):
+        # Every link of a page has the same origin
+        self.origin = intern_str(self.origin)
+
     @staticmethod
     def load(data: dict):
         from .page import Page
 
         if data["resource"]["type"] == "page":
-            data["resource"] = Page.load(data["resource"])
+            resource = Page.load(data["resource"])
         else:
-            data["resource"] = Resource.load(data["resource"])
+            resource = Resource.load(data["resource"])
 
-        return Link(**data)
+        return Link(**{**data, "resource": resource})
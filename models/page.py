@@ -4,12 +4,11 @@ from .link import Link
 from .resource import Resource
 
 
-@dataclass
+@dataclass(slots=True)
 class Page(Resource):
     type: str = "page"
     complete: bool = False
 
     @staticmethod
     def load(data: dict):
-        data["links"] = list(map(lambda l: Link.load(l), data.get("links", [])))
-        return Page(**data)
+        return Page(**{**data, "links": list(map(lambda l: Link.load(l), data.get("links", [])))})
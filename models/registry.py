@@ -0,0 +1,65 @@
+import threading
+from collections import OrderedDict
+from typing import Type
+
+from .page import Page
+from .resource import Resource
+
+
+class ResourceRegistry:
+    """
+    Shares the resources pointed by links between every page holding a link to them: links to the
+    same url get the same resource object instead of their own copy.
+
+    Placeholders (resources not retrieved yet) are shared per url and class, resources loaded from
+    a manifest per url, as long as the manifest is unchanged (the manifest index keeps returning the
+    same dict for it). Only the last size urls are kept.
+
+    The resources handed out are shared between threads and must never be modified: a link whose
+    resource changes gets a copy of it (dataclasses.replace), see skydump.resolve_link/store_link.
+
+    size: number of urls kept
+    """
+
+    def __init__(self, size: int = 16384):
+        self.size = size
+
+        self._placeholders: OrderedDict = OrderedDict()
+        self._loaded: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _put(self, entries: OrderedDict, key, value):
+        entries[key] = value
+        entries.move_to_end(key)
+        if len(entries) > self.size:
+            entries.popitem(last=False)
+
+    def placeholder(self, rsc_class: Type[Resource], remote_url: str, protocol: str, domain: str) -> Resource:
+        key = (rsc_class, remote_url)
+
+        with self._lock:
+            rsc = self._placeholders.get(key)
+            if rsc is None:
+                rsc = rsc_class(remote_url=remote_url, protocol=protocol, domain=domain)
+            self._put(self._placeholders, key, rsc)
+            return rsc
+
+    def load(self, data: dict) -> Resource:
+        """
+        Returns the resource of the manifest content data, loaded once per version of the manifest.
+        """
+
+        remote_url = data["remote_url"]
+
+        with self._lock:
+            entry = self._loaded.get(remote_url)
+            if entry is not None and entry[0] is data:
+                self._loaded.move_to_end(remote_url)
+                return entry[1]
+
+        rsc = Page.load(data) if data.get("type", None) == "page" else Resource.load(data)
+
+        with self._lock:
+            self._put(self._loaded, remote_url, (data, rsc))
+
+        return rsc
@@ -1,3 +1,4 @@
+import sys
 from dataclasses import dataclass, field
 from typing import List
 
@@ -6,7 +7,12 @@ if TYPE_CHECKING:
     from .link import Link
 
 
-@dataclass
+def intern_str(value):
+    # Hosts, protocols and content types are repeated over every resource, only one copy of each is kept
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+@dataclass(slots=True)
 class Resource:
     type: str = "resource"
     protocol: str = field(default="")
@@ -18,9 +24,20 @@ class Resource:
     return_code: int = field(default=-1)
     links: List['Link'] = field(default_factory=list)
     complete: bool = False
+    digest: str = field(default="")
+    etag: str = field(default="")
+    last_modified: str = field(default="")
+    content_length: int = field(default=-1)
+
+    def __post_init__(self):
+        self.type = intern_str(self.type)
+        self.protocol = intern_str(self.protocol)
+        self.domain = intern_str(self.domain)
+        self.content_type = intern_str(self.content_type)
+        self.content_encoding = intern_str(self.content_encoding)
 
     @staticmethod
     def load(data: dict):
         from .link import Link
-        data["links"] = list(map(lambda l: Link.load(l), data.get("links", [])))
-        return Resource(**data)
+        # data is left untouched so it can be loaded again (eg. from the manifest index cache)
+        return Resource(**{**data, "links": list(map(lambda l: Link.load(l), data.get("links", [])))})
@@ -0,0 +1,16 @@
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass(frozen=True, slots=True)
+class Url:
+    """
+    Parsed form of a url, computed once by skydump.normalize_url and shared between its users.
+    """
+
+    url: str
+    protocol: Optional[str]
+    domain: str
+    path: Optional[str]
+    query: Optional[str]
+    local_url: str
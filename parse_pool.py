@@ -0,0 +1,75 @@
+import re
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+import requests
+
+from models.page import Page
+from models.resource import Resource
+
+import skydump
+from skydump import get_link_pairs, remap_html_pairs, remap_css_pairs
+
+
+class ParsePool:
+    """
+    Process pool running the CPU bound stages of the crawl, link extraction and remapping, on
+    every core instead of in the threads doing the network and disk I/O under the same GIL.
+
+    Workers only receive a document and plain values, and send back compact link records
+    (see skydump.LinkRecord) or the remapped document; Link objects are built by the caller.
+
+    parse_page/parse_css are drop-in replacements of the skydump functions, rewrite_page/rewrite_css
+    are given to post_process_page/post_process_css. Only the default remapping is run by the workers:
+    PAGE_POST_PROCESSORS and CSS_POST_PROCESSORS are not, as lambdas can't be sent to another process.
+
+    Workers are spawned, so the script creating the pool must guard its crawl with
+    if __name__ == "__main__" (the workers import it again). The parse_page/parse_css timers of
+    skydump.METRICS include the transfer to the workers but not their CPU time.
+
+    max_workers: number of worker processes, defaults to the number of cores
+    """
+
+    def __init__(self, max_workers: int = None):
+        self.max_workers = max_workers
+
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # Forking the crawler while its threads hold locks (logging, connection pools) could
+                # deadlock the workers, they are started from a fresh interpreter instead
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def _call(self, fn, *args):
+        # Blocks the calling thread only, the GIL is released while waiting on the worker
+        return self._get_executor().submit(fn, *args).result()
+
+    def parse_page(self,
+                   page: Page,
+                   allow_crawl_conditions: List[re.Pattern] = list(),
+                   forbid_crawl_conditions: List[re.Pattern] = list(),
+                   response: requests.Response = None,
+                   html_doc: str = None):
+        return skydump.parse_page(page, allow_crawl_conditions, forbid_crawl_conditions, response, html_doc, extract=self._call)
+
+    def parse_css(self, css_rsc: Resource, response: requests.Response = None, css_doc: str = None):
+        return skydump.parse_css(css_rsc, response, css_doc, extract=self._call)
+
+    def rewrite_page(self, page_content: str, page: Page) -> str:
+        return self._call(remap_html_pairs, page_content, page.local_url, get_link_pairs(page.links), True)
+
+    def rewrite_css(self, css_content: str, css_rsc: Resource) -> str:
+        return self._call(remap_css_pairs, css_content, css_rsc.local_url, get_link_pairs(css_rsc.links), True)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
@@ -0,0 +1,170 @@
+import re
+import time
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional
+
+import requests
+
+
+BACKOFF_STATUS_CODES = (429, 503)
+
+
+@dataclass
+class HostRateLimit:
+    """
+    Rate limit applied to every host whose domain matches pattern.
+
+    pattern: regex searched in the domain, None to match any host
+    rate: sustained number of requests per second
+    burst: number of requests that can be sent at once after the host has been idle
+    """
+    pattern: Optional[re.Pattern] = field(default=None)
+    rate: float = field(default=5)
+    burst: int = field(default=5)
+
+    def matches(self, domain: str) -> bool:
+        return self.pattern is None or self.pattern.search(domain) is not None
+
+
+class TokenBucket:
+    """
+    Token bucket handing out reservations: each request takes a token and gets back
+    how long it has to wait for it, so concurrent callers are spread over time.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+
+        self.tokens = float(burst)
+        self.last_update = time.monotonic()
+        self.blocked_until = 0.0
+        # Consecutive 429/503 answered without Retry-After
+        self.backoffs = 0
+
+    def reserve(self, now: float) -> float:
+        self.tokens = min(self.burst, self.tokens + (now - self.last_update) * self.rate)
+        self.last_update = now
+
+        # Tokens can go negative: the debt is the queue of requests already waiting
+        self.tokens -= 1
+
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.blocked_until - now)
+
+    def block(self, until: float):
+        self.blocked_until = max(self.blocked_until, until)
+
+
+class RateLimiter:
+    """
+    Per host politeness: every host gets its own token bucket, configured from the first
+    HostRateLimit matching its domain. Waiting only happens when the same host is hit
+    faster than allowed, and a host answering 429/503 is paused for its Retry-After delay, or
+    for an exponential back-off when it doesn't send one.
+
+    limits: per host pattern limits, the first matching one is used
+    default: limit of the hosts matching none of limits
+    backoff: back-off delay (in seconds) of a 429/503 without a usable Retry-After, doubled
+             for each consecutive one from the same host
+    max_backoff: bound of the back-off delay
+    """
+
+    def __init__(self,
+                 limits: List[HostRateLimit] = list(),
+                 default: HostRateLimit = None,
+                 backoff: float = 1,
+                 max_backoff: float = 8):
+        self.limits = limits
+        self.default = default or HostRateLimit()
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def get_limit(self, domain: str) -> HostRateLimit:
+        for limit in self.limits:
+            if limit.matches(domain):
+                return limit
+        return self.default
+
+    def _bucket(self, domain: str) -> TokenBucket:
+        if domain not in self._buckets:
+            limit = self.get_limit(domain)
+            self._buckets[domain] = TokenBucket(limit.rate, limit.burst)
+        return self._buckets[domain]
+
+    def reserve(self, domain: str) -> float:
+        """
+        Takes a request slot on domain, returns the delay (in seconds) to wait before sending it.
+        """
+
+        with self._lock:
+            return self._bucket(domain).reserve(time.monotonic())
+
+    def wait(self, domain: str):
+        delay = self.reserve(domain)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self, domain: str):
+        delay = self.reserve(domain)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def handle_response(self, domain: str, response: requests.Response) -> bool:
+        """
+        Pauses domain if the response asks to back off.
+        Returns True if the request should be sent again.
+        """
+
+        if response is None:
+            return False
+
+        if response.status_code not in BACKOFF_STATUS_CODES:
+            with self._lock:
+                self._bucket(domain).backoffs = 0
+            return False
+
+        delay = parse_retry_after(response.headers.get("Retry-After"))
+
+        with self._lock:
+            bucket = self._bucket(domain)
+            if delay is None:
+                delay = min(self.backoff * 2 ** bucket.backoffs, self.max_backoff)
+                bucket.backoffs += 1
+            bucket.block(time.monotonic() + delay)
+
+        logging.warning(f"Host {domain} answered {response.status_code}, pausing it for {delay:.1f}s")
+
+        return True
+
+
+def parse_retry_after(value: str) -> Optional[float]:
+    """
+    Returns the delay in seconds of a Retry-After header, given either in seconds or as an HTTP date.
+    """
+
+    if not value:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    try:
+        retry_date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        logging.error(f"Can't parse Retry-After header {value}")
+        return None
+
+    if retry_date.tzinfo is None:
+        retry_date = retry_date.replace(tzinfo=timezone.utc)
+
+    return max(0.0, (retry_date - datetime.now(timezone.utc)).total_seconds())
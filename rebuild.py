@@ -0,0 +1,177 @@
+import os
+import sys
+import json
+import sqlite3
+import hashlib
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import backups
+import skydump
+from models.page import Page
+from models.resource import Resource
+
+
+REBUILT = "rebuilt"
+UNCHANGED = "unchanged"
+SKIPPED = "skipped"
+
+
+class RebuildState:
+    """
+    Inputs of every document at its last rebuild, so an incremental rebuild only remaps
+    the documents whose original or link targets have changed since.
+
+    path: path of the database file
+    """
+
+    def __init__(self, path: str = "rebuild.db"):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS documents (path TEXT PRIMARY KEY, key TEXT NOT NULL)")
+
+    def keys(self) -> Dict[str, str]:
+        return dict(self.connection.execute("SELECT path, key FROM documents"))
+
+    def update(self, keys: Dict[str, str]):
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO documents (path, key) VALUES (?, ?)", keys.items())
+
+    def close(self):
+        self.connection.close()
+
+
+def load_document(manifest_path: str) -> Optional[Resource]:
+    """
+    Returns the page or stylesheet described by the manifest at manifest_path if it has been remapped
+    and its original is backed up, None otherwise.
+    """
+
+    try:
+        rsc_json = skydump.read_resource_manifest(manifest_path)
+    except (OSError, ValueError):
+        return None
+
+    # Downloaded json resources are not manifests
+    if not isinstance(rsc_json, dict) or "remote_url" not in rsc_json or "type" not in rsc_json:
+        return None
+
+    rsc = Page.load(rsc_json) if rsc_json["type"] == "page" else Resource.load(rsc_json)
+
+    if not rsc.complete or not rsc.local_url or (rsc.type != "page" and rsc.content_type != "text/css"):
+        return None
+
+    if backups.find_backup(rsc.local_url) is None:
+        return None
+
+    return rsc
+
+
+def get_input_key(rsc: Resource) -> str:
+    # The output of a document only depends on its original and on where its links point to
+    backup_stat = os.stat(backups.find_backup(rsc.local_url))
+    inputs = [rsc.local_url, backup_stat.st_size, backup_stat.st_mtime_ns, skydump.get_link_pairs(rsc.links)]
+    return hashlib.sha256(json.dumps(inputs).encode("utf-8")).hexdigest()
+
+
+def rebuild_document(manifest_path: str, previous_key: str = None) -> Tuple[str, Optional[str], str]:
+    """
+    Remaps the document of the manifest at manifest_path again from its original, with the current
+    post-processors and the current local urls of its links, without any network access.
+    Returns (manifest_path, input key, status), the document being left as is if its key is previous_key.
+    """
+
+    rsc = load_document(manifest_path)
+    if rsc is None:
+        return manifest_path, None, SKIPPED
+
+    # Links point to the files as they are now in the mirror
+    for l in rsc.links:
+        link_json = skydump.read_resource_manifest(skydump.get_resource_local_url(l.resource.remote_url) + ".json")
+        if link_json is not None and link_json.get("local_url"):
+            l.resource.local_url = link_json["local_url"]
+
+    key = get_input_key(rsc)
+    if key == previous_key and os.path.isfile(rsc.local_url):
+        return manifest_path, key, UNCHANGED
+
+    original = backups.read_backup(rsc.local_url)
+
+    # Same decoding as post_process_page/post_process_css
+    post_processors = skydump.PAGE_POST_PROCESSORS if rsc.type == "page" else skydump.CSS_POST_PROCESSORS
+    content = skydump.apply_post_processors(post_processors, skydump.decode_document(original, rsc), rsc)
+    skydump.replace_file_content(rsc.local_url, skydump.encode_document(content, rsc))
+
+    logging.info(f"Rebuilt {rsc.local_url}")
+
+    return manifest_path, key, REBUILT
+
+
+def find_manifests(root: str = "."):
+    for dir_path, dir_names, file_names in os.walk(root):
+        for file_name in file_names:
+            if file_name.endswith(".json"):
+                # Paths as built by the crawler, relative to the working directory
+                yield os.path.relpath(os.path.join(dir_path, file_name))
+
+
+def rebuild(root: str = ".", workers: int = None, incremental: bool = True, state: RebuildState = None) -> Dict[str, int]:
+    """
+    Rebuilds every remapped page and stylesheet under root from the manifests and backups, in a process pool.
+    Must be run from the directory the crawl was run from, local urls being relative to it.
+    Returns the number of documents per status.
+
+    workers: number of processes, defaults to the number of cores, 0 to rebuild in the current process
+    incremental: only rebuild the documents whose inputs changed since the last rebuild recorded in state
+    state: inputs of the last rebuild, rebuild.db by default
+    """
+
+    state = state or RebuildState()
+    previous_keys = state.keys() if incremental else {}
+
+    manifest_paths = list(find_manifests(root))
+    previous = [previous_keys.get(path) for path in manifest_paths]
+
+    if workers == 0:
+        results = map(rebuild_document, manifest_paths, previous)
+        executor = None
+    else:
+        # Workers are spawned: the post-processors must be set up when the calling script is imported
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        results = executor.map(rebuild_document, manifest_paths, previous, chunksize=64)
+
+    counts = {REBUILT: 0, UNCHANGED: 0, SKIPPED: 0}
+    keys = {}
+
+    try:
+        for manifest_path, key, status in results:
+            counts[status] += 1
+            if key is not None:
+                keys[manifest_path] = key
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        state.update(keys)
+
+    logging.info(f"Rebuilt {counts[REBUILT]} documents, {counts[UNCHANGED]} unchanged, {counts[SKIPPED]} other manifests")
+
+    return counts
+
+
+if __name__ == "__main__":
+    # python rebuild.py [--full] [--workers N] [root], from the directory the crawl was run from
+    logging.basicConfig(level=logging.INFO)
+
+    args = sys.argv[1:]
+    incremental = "--full" not in args
+    workers = None
+    if "--workers" in args:
+        workers = int(args[args.index("--workers") + 1])
+        del args[args.index("--workers"):args.index("--workers") + 2]
+    args = [a for a in args if a != "--full"]
+
+    print(rebuild(args[0] if args else ".", workers, incremental))
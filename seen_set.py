@@ -0,0 +1,178 @@
+import os
+import math
+import struct
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Iterable, List
+
+from atomic_file import atomic_path
+
+
+SNAPSHOT_MAGIC = b"SKBF"
+SNAPSHOT_HEADER = struct.Struct("<4sQQQ")  # magic, number of bits, number of hashes, number of urls
+
+
+class BloomFilter:
+    """
+    Bloom filter over strings: a url never added is reported absent, a url added is always reported
+    present, and a url never added is reported present with a probability of about error_rate as long
+    as no more than capacity urls have been added. Costs about 1.2 bytes per url for a 1% error rate.
+
+    capacity: expected number of urls
+    error_rate: false positive rate at capacity
+    """
+
+    def __init__(self, capacity: int = 1000000, error_rate: float = 0.01):
+        self.capacity = capacity
+        self.error_rate = error_rate
+
+        self.n_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.n_hashes = max(1, round(self.n_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.n_bits + 7) // 8)
+
+    def _positions(self, url: str):
+        # Double hashing: k positions out of two 64 bits hashes
+        digest = hashlib.blake2b(url.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.n_bits for i in range(self.n_hashes)]
+
+    def add(self, url: str):
+        for position in self._positions(url):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, url: str) -> bool:
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(url))
+
+
+class SeenSet:
+    """
+    Set of urls scaling to the whole blog space: an exact set kept in a SQLite database, behind
+    a Bloom filter answering in memory for the urls never seen, which are most of the lookups
+    of a crawl discovering new pages.
+
+    The filter is snapshotted next to the database (on snapshot() and close()) and reloaded when
+    reopened, or rebuilt from the database if the snapshot doesn't match it (eg. after a crash).
+
+    path: path of the database file, the snapshot being path + ".bloom"
+    capacity: expected number of urls, the false positive rate growing beyond it
+    error_rate: false positive rate of the filter at capacity
+    commit_interval: number of added urls committed at once
+    """
+
+    def __init__(self,
+                 path: str = "seen.db",
+                 capacity: int = 10000000,
+                 error_rate: float = 0.01,
+                 commit_interval: int = 1000):
+        self.path = path
+        self.snapshot_path = path + ".bloom"
+        self.commit_interval = commit_interval
+
+        # Used from the asset fetcher threads, every access goes through the lock
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY) WITHOUT ROWID")
+
+        self._count = self.connection.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+        self._uncommitted = 0
+        self._lock = threading.Lock()
+
+        self.filter = self._load_snapshot(capacity, error_rate)
+        if self.filter is None:
+            self.filter = BloomFilter(max(capacity, self._count), error_rate)
+            if self._count:
+                logging.info(f"Rebuilding the filter of {path} from {self._count} urls")
+                for (url,) in self.connection.execute("SELECT url FROM urls"):
+                    self.filter.add(url)
+
+    def _load_snapshot(self, capacity: int, error_rate: float):
+        if not os.path.exists(self.snapshot_path):
+            return None
+
+        with open(self.snapshot_path, "rb") as fp:
+            magic, n_bits, n_hashes, count = SNAPSHOT_HEADER.unpack(fp.read(SNAPSHOT_HEADER.size))
+            bits = fp.read()
+
+        if magic != SNAPSHOT_MAGIC or count != self._count or len(bits) != (n_bits + 7) // 8:
+            logging.warning(f"Snapshot {self.snapshot_path} doesn't match {self.path}, ignoring it")
+            return None
+
+        bloom_filter = BloomFilter(capacity, error_rate)
+        bloom_filter.n_bits, bloom_filter.n_hashes, bloom_filter.bits = n_bits, n_hashes, bytearray(bits)
+        return bloom_filter
+
+    def _commit(self):
+        self.connection.commit()
+        self._uncommitted = 0
+
+    def add(self, url: str) -> bool:
+        """
+        Adds url, returns True if it had never been seen.
+        """
+
+        return bool(self.add_many([url]))
+
+    def add_many(self, urls: Iterable[str]) -> List[str]:
+        """
+        Adds urls, returns the ones never seen before.
+        """
+
+        added = []
+
+        with self._lock:
+            for url in urls:
+                cursor = self.connection.execute("INSERT OR IGNORE INTO urls (url) VALUES (?)", (url,))
+                if cursor.rowcount:
+                    self.filter.add(url)
+                    added.append(url)
+
+            self._count += len(added)
+            self._uncommitted += len(added)
+            if self._uncommitted >= self.commit_interval:
+                self._commit()
+
+        return added
+
+    def might_contain(self, url: str) -> bool:
+        """
+        Returns False if url has never been seen, True if it probably has, without any disk access.
+        """
+
+        return url in self.filter
+
+    def __contains__(self, url: str) -> bool:
+        if url not in self.filter:
+            return False
+
+        with self._lock:
+            return self.connection.execute("SELECT 1 FROM urls WHERE url = ?", (url,)).fetchone() is not None
+
+    def __len__(self):
+        return self._count
+
+    def snapshot(self):
+        """
+        Commits the added urls and writes the filter on disk.
+        """
+
+        with self._lock:
+            self._commit()
+
+            with atomic_path(self.snapshot_path) as tmp_path, open(tmp_path, "wb") as fp:
+                fp.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, self.filter.n_bits, self.filter.n_hashes, self._count))
+                fp.write(self.filter.bits)
+
+    def close(self):
+        if self.connection is None:
+            return
+
+        self.snapshot()
+        self.connection.close()
+        self.connection = None
@@ -0,0 +1,55 @@
+from typing import Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+DEFAULT_TIMEOUT = (10, 60)
+
+
+class CrawlSession(requests.Session):
+    """
+    requests Session applying a default timeout to every request.
+    Connections are pooled and kept alive per host by the mounted adapters.
+
+    timeout: default (connect, read) timeout in seconds, used when a request doesn't give one
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def create_session(headers: Dict[str, str] = None,
+                   timeout=DEFAULT_TIMEOUT,
+                   pool_connections: int = 16,
+                   pool_maxsize: int = 8,
+                   host_pool_sizes: Dict[str, int] = None) -> CrawlSession:
+    """
+    Creates the session shared by the whole crawl.
+
+    headers: default headers sent with every request (eg. User-Agent)
+    timeout: default (connect, read) timeout in seconds
+    pool_connections: number of hosts whose connection pool is kept
+    pool_maxsize: number of connections kept alive per host
+    host_pool_sizes: per host overrides of pool_maxsize, keyed by url prefix
+                     (eg. {"https://i.skyrock.net/": 16})
+    """
+
+    session = CrawlSession(timeout)
+
+    if headers:
+        session.headers.update(headers)
+
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    for prefix, size in (host_pool_sizes or {}).items():
+        session.mount(prefix, HTTPAdapter(pool_connections=1, pool_maxsize=size))
+
+    return session
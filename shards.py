@@ -0,0 +1,420 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from typing import Callable, Iterable, List, Optional
+
+from models.resource import Resource
+
+import skydump
+from skydump import normalize_url
+from manifest_index import ManifestIndex
+
+
+QUEUED = 0
+IN_PROGRESS = 1
+DONE = 2
+FAILED = 3
+
+# Number of times a page is crawled before it is recorded as failed
+MAX_ATTEMPTS = 3
+
+# Hosts serving the assets linked by every blog, downloaded once into the shared root
+SHARED_HOSTS = ["static.skyrock.net", "i.skyrock.net"]
+
+
+class ShardQueue:
+    """
+    Work queue of a crawl split between several worker processes, in a SQLite file they all open
+    (on a local disk: SQLite locking is not reliable on network filesystems).
+
+    Blogs are the shards: the pages are grouped by domain, one blog per subdomain, and a worker
+    claims a blog to crawl its pages, the pages found on other blogs being queued for whoever
+    claims them. A worker without any unclaimed blog left steals the queued pages of the blog with
+    the most pages left. Claims are leases renewed by heartbeat(): the pages and blogs of a worker
+    which stopped renewing them are handed to the other workers.
+
+    A page whose crawl fails is queued again after the other pages of its blog, and recorded as
+    failed after max_attempts attempts (see retry_failed), the pages only linked from it being
+    left undiscovered until then.
+
+    The resources of the shared hosts are claimed too, so each of them is downloaded by one worker only.
+
+    path: path of the database file
+    lease: seconds a claim is kept without heartbeat
+    max_attempts: number of times a page is crawled before it is recorded as failed
+    """
+
+    def __init__(self, path: str = "shards.db", lease: float = 600, max_attempts: int = MAX_ATTEMPTS):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+
+        # Every worker thread (crawl loop, heartbeat, asset fetcher) shares the connection through the lock
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+
+        with self._transaction():
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS pages (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    url TEXT NOT NULL UNIQUE,
+                    shard TEXT NOT NULL,
+                    state INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    heartbeat REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            # Databases created before the failures were counted
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(pages)")]
+            if "attempts" not in columns:
+                self.connection.execute("ALTER TABLE pages ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS pages_state_shard ON pages (state, shard, seq)")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS shards (
+                    shard TEXT PRIMARY KEY,
+                    worker TEXT NOT NULL,
+                    heartbeat REAL NOT NULL
+                )
+            """)
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS assets (
+                    url TEXT PRIMARY KEY,
+                    state INTEGER NOT NULL,
+                    worker TEXT,
+                    heartbeat REAL
+                )
+            """)
+
+    def _transaction(self):
+        return _Transaction(self.connection, self._lock)
+
+    def close(self):
+        self.connection.close()
+
+    def _insert(self, urls: Iterable[str]) -> int:
+        rows = [(url, normalize_url(url).domain) for url in urls]
+        return self.connection.executemany("INSERT OR IGNORE INTO pages (url, shard) VALUES (?, ?)", rows).rowcount
+
+    def add(self, urls: Iterable[str]) -> int:
+        """
+        Queues the urls never seen before, returns how many were added.
+        """
+
+        with self._transaction():
+            return self._insert(urls)
+
+    def _expire(self, now: float):
+        # Claims of the workers which stopped sending heartbeats go back to the queue
+        expired = now - self.lease
+        self.connection.execute("UPDATE pages SET state = ?, worker = NULL WHERE state = ? AND heartbeat < ?",
+                                (QUEUED, IN_PROGRESS, expired))
+        self.connection.execute("DELETE FROM shards WHERE heartbeat < ?", (expired,))
+        self.connection.execute("DELETE FROM assets WHERE state = ? AND heartbeat < ?", (IN_PROGRESS, expired))
+
+    def pop(self, worker: str) -> Optional[str]:
+        """
+        Takes the next page for worker, from the blogs it has claimed first, then from a new blog,
+        then from the blog with the most queued pages. Returns None when no page is queued.
+        """
+
+        now = time.time()
+
+        with self._transaction():
+            self._expire(now)
+
+            row = self.connection.execute("""
+                SELECT pages.seq, pages.url FROM pages JOIN shards ON pages.shard = shards.shard
+                WHERE shards.worker = ? AND pages.state = ? ORDER BY pages.seq LIMIT 1
+            """, (worker, QUEUED)).fetchone()
+
+            if row is None:
+                row = self.connection.execute("""
+                    SELECT seq, url, shard FROM pages
+                    WHERE state = ? AND shard NOT IN (SELECT shard FROM shards) ORDER BY seq LIMIT 1
+                """, (QUEUED,)).fetchone()
+
+                if row is not None:
+                    logging.info(f"Worker {worker} claims shard {row[2]}")
+                    self.connection.execute("INSERT INTO shards (shard, worker, heartbeat) VALUES (?, ?, ?)",
+                                            (row[2], worker, now))
+
+            if row is None:
+                shard = self.connection.execute("""
+                    SELECT shard FROM pages WHERE state = ? GROUP BY shard ORDER BY COUNT(*) DESC LIMIT 1
+                """, (QUEUED,)).fetchone()
+
+                if shard is not None:
+                    logging.info(f"Worker {worker} steals pages of shard {shard[0]}")
+                    row = self.connection.execute("SELECT seq, url FROM pages WHERE state = ? AND shard = ? ORDER BY seq LIMIT 1",
+                                                  (QUEUED, shard[0])).fetchone()
+
+            if row is None:
+                return None
+
+            self.connection.execute("UPDATE pages SET state = ?, worker = ?, heartbeat = ? WHERE seq = ?",
+                                    (IN_PROGRESS, worker, now, row[0]))
+
+        return row[1]
+
+    def done(self, url: str, discovered_urls: Iterable[str] = ()) -> int:
+        """
+        Marks url as crawled and queues the urls discovered on it in the same transaction,
+        returns how many new urls were queued.
+        """
+
+        with self._transaction():
+            added = self._insert(discovered_urls)
+            self.connection.execute("UPDATE pages SET state = ?, worker = NULL WHERE url = ?", (DONE, url))
+        return added
+
+    def fail(self, url: str) -> bool:
+        """
+        Records a failed crawl of url: it is queued again behind the pages already queued, unless
+        it has failed max_attempts times. Returns True if it is queued again.
+        """
+
+        with self._transaction():
+            row = self.connection.execute("SELECT shard, attempts FROM pages WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return False
+
+            shard, attempts = row[0], row[1] + 1
+
+            if attempts >= self.max_attempts:
+                logging.warning(f"Page {url} failed {attempts} times, giving up")
+                self.connection.execute("UPDATE pages SET state = ?, worker = NULL, attempts = ? WHERE url = ?",
+                                        (FAILED, attempts, url))
+                return False
+
+            # A new seq puts the page at the end of the queue
+            self.connection.execute("DELETE FROM pages WHERE url = ?", (url,))
+            self.connection.execute("INSERT INTO pages (url, shard, state, attempts) VALUES (?, ?, ?, ?)",
+                                    (url, shard, QUEUED, attempts))
+            return True
+
+    def retry_failed(self) -> int:
+        """
+        Queues the failed pages again, with a new count of attempts. Returns how many were queued.
+        """
+
+        with self._transaction():
+            return self.connection.execute("UPDATE pages SET state = ?, attempts = 0 WHERE state = ?",
+                                           (QUEUED, FAILED)).rowcount
+
+    def heartbeat(self, worker: str):
+        """
+        Renews the claims of worker.
+        """
+
+        now = time.time()
+
+        with self._transaction():
+            self.connection.execute("UPDATE pages SET heartbeat = ? WHERE worker = ? AND state = ?", (now, worker, IN_PROGRESS))
+            self.connection.execute("UPDATE shards SET heartbeat = ? WHERE worker = ?", (now, worker))
+            self.connection.execute("UPDATE assets SET heartbeat = ? WHERE worker = ? AND state = ?", (now, worker, IN_PROGRESS))
+
+    def claim_asset(self, url: str, worker: str) -> bool:
+        """
+        Returns True if worker has to download the resource at url, False if it has been or is
+        being downloaded by another worker.
+        """
+
+        with self._transaction():
+            self._expire(time.time())
+            return self.connection.execute("INSERT OR IGNORE INTO assets (url, state, worker, heartbeat) VALUES (?, ?, ?, ?)",
+                                           (url, IN_PROGRESS, worker, time.time())).rowcount > 0
+
+    def done_asset(self, url: str):
+        with self._transaction():
+            self.connection.execute("UPDATE assets SET state = ?, worker = NULL WHERE url = ?", (DONE, url))
+
+    def release_asset(self, url: str):
+        """
+        Gives up the download of the resource at url, another worker may claim it.
+        """
+
+        with self._transaction():
+            self.connection.execute("DELETE FROM assets WHERE url = ?", (url,))
+
+    def wait_asset(self, url: str, poll_interval: float = 0.5) -> bool:
+        """
+        Waits for the download of the resource at url by another worker.
+        Returns True once it is done, False if it has been given up or if its claim has expired.
+        """
+
+        while True:
+            with self._lock:
+                row = self.connection.execute("SELECT state, heartbeat FROM assets WHERE url = ?", (url,)).fetchone()
+
+            if row is None or (row[0] == IN_PROGRESS and row[1] < time.time() - self.lease):
+                return False
+            if row[0] == DONE:
+                return True
+
+            time.sleep(poll_interval)
+
+    def pending(self) -> int:
+        """
+        Returns the number of pages queued or being crawled.
+        """
+
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM pages WHERE state IN (?, ?)",
+                                           (QUEUED, IN_PROGRESS)).fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM pages WHERE state = ?", (QUEUED,)).fetchone()[0]
+
+
+class _Transaction:
+    """
+    Write transaction taken at once (BEGIN IMMEDIATE), so two workers can't claim the same row.
+    """
+
+    def __init__(self, connection: sqlite3.Connection, lock: threading.Lock):
+        self.connection = connection
+        self.lock = lock
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            self.connection.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            self.lock.release()
+            raise
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.connection.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        finally:
+            self.lock.release()
+
+
+class SharedAssets:
+    """
+    Coordinates the downloads of the resources of the shared hosts between the workers of a
+    ShardQueue (see skydump.SHARED_ASSETS).
+
+    queue: shard queue of the crawl
+    worker: name of this worker
+    hosts: domains whose resources are shared
+    """
+
+    def __init__(self, queue: ShardQueue, worker: str, hosts: List[str] = SHARED_HOSTS):
+        self.queue = queue
+        self.worker = worker
+        self.hosts = set(hosts)
+
+    def is_shared(self, url: str) -> bool:
+        return normalize_url(url).domain in self.hosts
+
+    def claim(self, url: str) -> bool:
+        return self.queue.claim_asset(url, self.worker)
+
+    def wait(self, url: str) -> bool:
+        return self.queue.wait_asset(url)
+
+    def done(self, url: str):
+        self.queue.done_asset(url)
+
+    def release(self, url: str):
+        self.queue.release_asset(url)
+
+
+def link_shared_hosts(root: str, shared_root: str, hosts: List[str] = SHARED_HOSTS):
+    """
+    Points the directories of the shared hosts in root to the ones in shared_root, so the workers
+    write and find the shared resources at the same place, with the same local urls.
+    """
+
+    for host in hosts:
+        shared_path = os.path.abspath(os.path.join(shared_root, host))
+        os.makedirs(shared_path, exist_ok=True)
+
+        path = os.path.join(root, host)
+        if not os.path.lexists(path):
+            os.symlink(shared_path, path, target_is_directory=True)
+
+
+def run_worker(queue: ShardQueue,
+               worker: str,
+               root: str,
+               shared_root: str,
+               allow_crawl_conditions=list(),
+               forbid_crawl_conditions=list(),
+               page_filter: Callable[[Resource], bool] = None,
+               shared_hosts: List[str] = SHARED_HOSTS,
+               poll_interval: float = 5):
+    """
+    Crawls the pages of queue as worker until every page is crawled, in its own output root.
+    The roots of the workers can be merged into one mirror afterwards (eg. cp -rn root/* mirror),
+    the shared resources being in shared_root.
+
+    root: output root of this worker, the working directory is changed to it
+    shared_root: output root of the shared hosts, common to every worker
+    page_filter: called with each linked resource of type page, returns True to crawl it
+    poll_interval: seconds waited for other workers to discover pages when the queue is empty
+    """
+
+    os.makedirs(root, exist_ok=True)
+    link_shared_hosts(root, shared_root, shared_hosts)
+    os.chdir(root)
+
+    # Manifests are looked up relative to the new working directory
+    skydump.MANIFEST_INDEX = ManifestIndex()
+    skydump.MANIFEST_INDEX.scan(".")
+    skydump.SHARED_ASSETS = SharedAssets(queue, worker, shared_hosts)
+
+    stop_heartbeat = threading.Event()
+
+    def _heartbeat():
+        while not stop_heartbeat.wait(queue.lease / 4):
+            queue.heartbeat(worker)
+
+    threading.Thread(target=_heartbeat, daemon=True).start()
+
+    n_pages = 0
+
+    try:
+        while True:
+            url = queue.pop(worker)
+
+            if url is None:
+                # Pages being crawled by the other workers may still discover more
+                if queue.pending() == 0:
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            logging.info(f"---- {worker} GETTING PAGE {url} ----")
+            try:
+                page = skydump.crawl_page(url, allow_crawl_conditions, forbid_crawl_conditions)
+            except Exception as err:
+                logging.exception(f"Error while crawling page {url}: {err}")
+                queue.fail(url)
+                continue
+
+            # The manifests of the page must be on disk before it is recorded as done
+            skydump.MANIFEST_WRITER.flush()
+            queue.done(url, [l.resource.remote_url for l in page.links
+                             if l.resource.type == "page" and (page_filter is None or page_filter(l.resource))])
+            n_pages += 1
+
+        if skydump.CSS_QUEUE is not None:
+            skydump.CSS_QUEUE.finalize()
+            skydump.MANIFEST_WRITER.flush()
+
+    finally:
+        stop_heartbeat.set()
+
+    logging.info(f"Worker {worker} crawled {n_pages} pages")
+
+    return n_pages
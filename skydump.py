@@ -2,20 +2,37 @@ import requests
 import re
 import os
 import logging
-import shutil
 import mimetypes
 import json
 import html
-import time
-from dataclasses import dataclass, asdict, replace
-from typing import List, Set
+import hashlib
+import atexit
+from dataclasses import dataclass, asdict, fields, replace
+from functools import lru_cache, wraps
+from typing import List, Set, Tuple
 from urllib.parse import urljoin 
 
-from bs4 import BeautifulSoup, PageElement, Tag
+from extractors import LINK_ATTRIBUTES, LinkExtractor, TokenizerExtractor
 
 from models.link import Link
+from models.url import Url
 from models.page import Page
-from models.resource import Resource
+from models.resource import Resource, intern_str
+from models.registry import ResourceRegistry
+
+from ratelimit import HostRateLimit, RateLimiter
+from session import create_session
+from manifest_index import ManifestIndex, iter_manifests
+from manifest_writer import ManifestWriter
+from content_store import ContentStore
+from asset_fetcher import AssetFetcher
+from metrics import Metrics
+from seen_set import SeenSet
+from css_queue import CssQueue
+from charsets import CharsetDetector, normalize_charset
+from atomic_file import atomic_path, replace_file_content
+import backups
+from archive import Archive, FilePayload, RESPONSE, CONVERSION, METADATA, build_http_response
 
 
 REG_DOMAIN = re.compile(r"([a-zA-Z]*://[^\/]+)", re.I)
@@ -25,150 +42,293 @@ REG_PAGE = re.compile(r"/(\d+)\.html", re.I)
 REG_RESOURCE_OLD = re.compile(r'"((?:[a-zA-Z]*://)?[^ "]+)"', re.I)
 REG_RESOURCE = re.compile(r'((?:[a-zA-Z]*:\/)?\/.+)', re.I)
 REG_URL_NO_PROTOCOL = re.compile(r"^([a-zA-Z]+://)?([^\/]*)(\/[^?]*)?(\?.*)?", re.I)
+REG_CSS_URL = re.compile(r'url\(["\']?([^\)"\']*)["\']?\)')
 #(.+)
 
 
-def parse_page(page: Page,
-               allow_crawl_conditions: List[re.Pattern] = list(),
-               forbid_crawl_conditions: List[re.Pattern] = list()):
+# Politeness per host: blog subdomains serve the html pages, static hosts can take a faster pace
+RATE_LIMITER = RateLimiter(
+    [
+        HostRateLimit(re.compile(r"^(?:static|i)\.skyrock\.net$", re.I), rate=10, burst=20),
+        HostRateLimit(REG_BLOG, rate=1, burst=2),
+    ],
+    default=HostRateLimit(rate=5, burst=5),
+)
+
+MAX_RETRIES = 3
+
+# Session shared by every request of the crawl, so connections to the same host are kept alive
+SESSION = create_session(host_pool_sizes={
+    "https://static.skyrock.net/": 16,
+    "https://i.skyrock.net/": 16,
+})
+
+
+# Manifests already written on disk, call MANIFEST_INDEX.scan() at startup to load an existing archive at once
+MANIFEST_INDEX = ManifestIndex()
+
+# Writes the manifests, eg. ManifestWriter(batch_size=256, compact=True) to buffer them and write compact manifests
+MANIFEST_WRITER = ManifestWriter()
+atexit.register(lambda: MANIFEST_WRITER.flush())
+
+# Optional set of the urls whose manifest has been written, eg. SeenSet("stored_urls.db"): links to
+# urls it has never seen are downloaded right away, without looking for their manifest on disk.
+# It must know every resource of the archive (see fill_stored_urls) and replaces MANIFEST_INDEX.scan()
+# on archives too large to index in memory
+STORED_URLS: SeenSet = None
+atexit.register(lambda: STORED_URLS is not None and STORED_URLS.close())
+
+# Optional background queue the linked stylesheets are crawled in instead of during the post-processing of
+# each page, eg. CssQueue(crawl_css), CSS_QUEUE.finalize() having to be called at the end of the crawl
+CSS_QUEUE: CssQueue = None
+
+# Coordinates the downloads of the resources shared by the workers of a sharded crawl (see shards.SharedAssets)
+SHARED_ASSETS = None
+
+# Resources pointed by links, shared between the links to the same url
+RESOURCE_REGISTRY = ResourceRegistry()
+
+# Backend extracting the tags holding links in parse_page (see extractors.EXTRACTORS)
+LINK_EXTRACTOR: LinkExtractor = TokenizerExtractor()
+
+# Worker pool retrieving the links of a page or a stylesheet concurrently
+ASSET_FETCHER = AssetFetcher(max_workers=8, per_host_concurrency=4)
+
+# Resources already revalidated during this run
+REVALIDATED_URLS = set()
+
+# Optional content-addressed storage of the downloaded bodies, eg. ContentStore("_objects")
+CONTENT_STORE: ContentStore = None
+
+# Optional WARC segments the complete resources are packed in, eg. Archive("archive"), instead of
+# keeping a file, a manifest and a backup per resource in the mirror
+ARCHIVE: Archive = None
+
+# How the originals of pages and stylesheets are kept before being remapped (see backups):
+# hardlinked by default, the remapped files being written to new files then renamed
+BACKUP_STRATEGY = backups.LINK
+
+# Decides the encoding of the downloaded text documents, detection running only when nothing is declared
+CHARSET_DETECTOR = CharsetDetector()
+
+# Number of parsed urls and crawl verdicts kept by normalize_url and is_crawl_allowed
+URL_CACHE_SIZE = 65536
+
+# Timers and counters of the crawl stages, eg. Metrics(report_interval=30, export_path="metrics.jsonl")
+METRICS = Metrics(enabled=False)
+
+
+def timed(name):
+    """
+    Records the time spent in the decorated function under name in METRICS.
     """
-    Downloads a page, parse it, returns a list of Link objects extracted from
-    what as been found in the Page
 
-    url: page to parse
-    allow_crawl_conditions: list of regexes that must match to allow the link to be entered
-    forbid_crawl_conditions: list of regexes that must NOT match to allow the link to be entered
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with METRICS.timer(name):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def fetch(url, throttle=True, retries=MAX_RETRIES, session: requests.Session = None, stream=False, headers=None):
+    """
+    Issues a single GET request for url. The returned response is meant to be
+    shared by every stage that needs it (link extraction, mimetype detection, saving)
+    so that a resource is never downloaded twice.
+
+    url: url to request
+    throttle: wait for the host rate limit before sending the request, and send it again
+              (up to retries times) if the host asks to back off with a 429/503
+    session: session to send the request with, defaults to the shared SESSION
+    stream: only read the headers, the body being read later on by download
+    headers: additional request headers (eg. conditional headers from get_conditional_headers)
     """
-    
-    url = page.remote_url
-    logging.info(f"Requesting page {url}")
 
-    time.sleep(1)
-    
-    response = requests.get(url)
-    if response:
-        logging.info(f"Finished download of page {url}.")
+    session = session or SESSION
 
-        html_doc = response.text
+    domain = normalize_url(url).domain
 
-        soup = BeautifulSoup(html_doc, 'html.parser')
-        link_attr_list = ["src", "href"]  # "content"
+    for attempt in range(retries + 1):
+        if throttle:
+            with METRICS.timer("rate_limit_wait"):
+                RATE_LIMITER.wait(domain)
 
-        def _predicate(t: Tag):
-            return any(map(t.has_attr, link_attr_list))
-        
-        discovered_link_urls = []
+        logging.info(f"Requesting {url}")
 
-        page.links = []
+        # Connection, request and response headers (the whole body unless streaming)
+        with METRICS.timer("request"):
+            response = session.get(url, stream=stream, headers=headers)
+        METRICS.count("requests")
 
-        url_list: List[Tag] = soup.find_all(_predicate)
-        for u in url_list:
-            new_link = Link()
-            new_link.origin = url
+        if not throttle or not RATE_LIMITER.handle_response(domain, response):
+            break
 
-            if u.name == "a":
-                link_str = u.get("href")
+        response.close()
 
-                discovered_link_urls.append(link_str)
+    return response
 
-                logging.info(f"Found link {link_str}")
 
-                url_reg = REG_URL_NO_PROTOCOL.search(link_str)
-                if not url_reg:
-                    raise Exception(f"Can't parse resource url: {link_str}")
-                
-                new_link.resource = Page()
-                new_link.original_url = link_str
+# Compact description of a link found in a document: (type, original url, remote url, protocol, domain)
+LinkRecord = Tuple[str, str, str, str, str]
 
-                new_link.resource.remote_url = link_str
-                new_link.resource.protocol = url_reg.group(1)
-                new_link.resource.domain = url_reg.group(2)
 
-                if link_str.startswith("/"):
-                    new_link.resource.remote_url = page.protocol + page.domain + link_str
-                    new_link.resource.protocol = page.protocol
-                    new_link.resource.domain = page.domain
-                
-                elif all(map(lambda r: r.search(link_str) is not None, allow_crawl_conditions)) and all(map(lambda r: r.search(link_str) is None, forbid_crawl_conditions)):
-                    new_link.resource.remote_url = link_str
-                    
-                else:
-                    logging.info(f"Ignored link {link_str}")
-                    continue
+def extract_page_links(url, protocol, domain, html_doc,
+                       allow_crawl_conditions: List[re.Pattern] = list(),
+                       forbid_crawl_conditions: List[re.Pattern] = list(),
+                       extractor: LinkExtractor = None) -> List[LinkRecord]:
+    """
+    Extracts the links of an html document as compact records.
+    Only works on plain values so it can be run in another process (see parse_pool).
+
+    url, protocol, domain: url of the page and its parsed protocol and domain
+    """
+
+    extractor = extractor or LINK_EXTRACTOR
+
+    link_records = []
+
+    for tag_name, tag_attrs in extractor.extract(html_doc):
+        if tag_name == "a":
+            link_str = tag_attrs.get("href")
+
+            logging.debug("Found link %s", link_str)
+
+            if link_str.startswith("/"):
+                link_records.append(("page", link_str, protocol + domain + link_str, protocol, domain))
             
+            elif is_crawl_allowed(link_str, allow_crawl_conditions, forbid_crawl_conditions):
+                link_url = normalize_url(link_str)
+                link_records.append(("page", link_str, link_str, link_url.protocol, link_url.domain))
+                
             else:
-                for attr in link_attr_list:
-                    link_str = u.get(attr)
+                logging.debug("Ignored link %s", link_str)
+        
+        else:
+            link_record = None
+
+            for attr in LINK_ATTRIBUTES:
+                link_str = tag_attrs.get(attr)
+                
+                if link_str and REG_RESOURCE.match(link_str) and not link_str.startswith("//"):
+                    original_url = link_str
+
+                    if link_str.startswith("/"):
+                        link_str = url + link_str
                     
-                    if link_str and REG_RESOURCE.match(link_str) and not link_str.startswith("//"):
-                        discovered_link_urls.append(link_str)
+                    logging.debug("Found resource %s", link_str)
 
-                        new_link.resource = Resource()
-                        new_link.original_url = link_str
+                    # The last matching attribute of the tag wins
+                    link_url = normalize_url(link_str)
+                    link_record = ("resource", original_url, link_str, link_url.protocol, link_url.domain)
 
-                        if link_str.startswith("/"):
-                            link_str = url + link_str
-                        
-                        logging.info(f"Found resource {link_str}")
+            if link_record and link_record[2]:
+                link_records.append(link_record)
 
-                        url_reg = REG_URL_NO_PROTOCOL.search(link_str)
-                        if not url_reg:
-                            raise Exception(f"Can't parse resource url: {link_str}")
+    return link_records
 
-                        new_link.resource.remote_url = link_str
-                        new_link.resource.protocol = url_reg.group(1)
-                        new_link.resource.domain = url_reg.group(2)
 
-            if new_link.resource \
-                and new_link.resource.remote_url:
-                
-                page.links.append(new_link)
-    
-    return page
+def extract_css_links(url, css_doc) -> List[LinkRecord]:
+    """
+    Extracts the url() links of a stylesheet as compact records.
+    """
 
+    link_records = []
 
-def parse_css(css_rsc: Resource):
-    css_rsc.links = []
+    for match in REG_CSS_URL.finditer(css_doc):
+        original_url = match.group(1)
+        link_str = urljoin(url, original_url)
 
-    url = css_rsc.remote_url
+        logging.debug("Found resource %s", link_str)
+
+        link_url = normalize_url(link_str)
+        link_records.append(("resource", original_url, link_str, link_url.protocol, link_url.domain))
+
+    return link_records
+
+
+def extract_in_thread(fn, *args):
+    # Default extract of parse_page/parse_css, see parse_pool.ParsePool for the out of process one
+    return fn(*args)
+
+
+def build_links(origin, link_records: List[LinkRecord]) -> List[Link]:
+    links = []
+
+    for rsc_type, original_url, remote_url, protocol, domain in link_records:
+        rsc_class = Page if rsc_type == "page" else Resource
+        links.append(Link(origin=origin,
+                          original_url=original_url,
+                          resource=RESOURCE_REGISTRY.placeholder(rsc_class, remote_url, protocol, domain)))
+
+    return links
 
-    time.sleep(0.2)
+
+def parse_page(page: Page,
+               allow_crawl_conditions: List[re.Pattern] = list(),
+               forbid_crawl_conditions: List[re.Pattern] = list(),
+               response: requests.Response = None,
+               html_doc: str = None,
+               extractor: LinkExtractor = None,
+               extract=extract_in_thread):
+    """
+    Downloads a page, parse it, returns a list of Link objects extracted from
+    what as been found in the Page
+
+    url: page to parse
+    allow_crawl_conditions: list of regexes that must match to allow the link to be entered
+    forbid_crawl_conditions: list of regexes that must NOT match to allow the link to be entered
+    response: already fetched response of the page, the page is downloaded if not given
+    html_doc: content of the page if already known (eg. read back from the archive), nothing is downloaded
+    extractor: backend extracting the tags holding links, defaults to LINK_EXTRACTOR
+    extract: fn(extract_fn, *args) running the link extraction, in the calling thread by default
+    """
     
-    response = requests.get(url)
+    url = page.remote_url
 
-    css_url_reg = REG_URL_NO_PROTOCOL.search(url)
-    if not css_url_reg:
-        raise Exception(f"Can't parse resource url: {url}")
+    if html_doc is None:
+        if response is None:
+            response = fetch(url)
 
-    protocol = css_url_reg.group(1)
-    domain = css_url_reg.group(2)
+        if response:
+            logging.info(f"Finished download of page {url}.")
+            html_doc = get_response_text(response)
 
-    if response:
-        if response.headers["Content-Type"] != "text/css":
-            raise Exception(f"Resource at url {url} is not a css file")
+    if html_doc is not None:
+        with METRICS.timer("parse_page"):
+            link_records = extract(extract_page_links, url, page.protocol, page.domain, html_doc,
+                                   allow_crawl_conditions, forbid_crawl_conditions, extractor or LINK_EXTRACTOR)
+            page.links = build_links(url, link_records)
+        METRICS.count("links", len(page.links))
     
-        for match in re.compile(r'url\(["\']?([^\)"\']*)["\']?\)').finditer(response.text):
-            link_str = match.group(1)
+    return page
 
-            new_link = Link()
-            new_link.origin = url
-            
-            new_link.resource = Resource()
-            new_link.original_url = link_str
 
-            link_str = urljoin(url, link_str)
+def parse_css(css_rsc: Resource, response: requests.Response = None, css_doc: str = None, extract=extract_in_thread):
+    """
+    Downloads a stylesheet and extracts its url() links, see parse_page.
+    """
 
-            logging.info(f"Found resource {link_str}")
+    css_rsc.links = []
 
-            url_reg = REG_URL_NO_PROTOCOL.search(link_str)
-            if not url_reg:
-                raise Exception(f"Can't parse resource url: {link_str}")
+    url = css_rsc.remote_url
+
+    if css_doc is None:
+        if response is None:
+            response = fetch(url)
+
+        if response:
+            if response.headers["Content-Type"] != "text/css":
+                raise Exception(f"Resource at url {url} is not a css file")
 
-            new_link.resource.remote_url = link_str
-            new_link.resource.protocol = url_reg.group(1)
-            new_link.resource.domain = url_reg.group(2)
+            css_doc = get_response_text(response)
 
-            css_rsc.links.append(new_link)
+    if css_doc is not None:
+        with METRICS.timer("parse_css"):
+            css_rsc.links = build_links(url, extract(extract_css_links, url, css_doc))
+        METRICS.count("links", len(css_rsc.links))
     
     return css_rsc
 
@@ -190,6 +350,11 @@ def parse_url(url, add_extension=None):
         logging.warning(f"Can't download page {url}: non conform URL ")
         return None
 
+    return split_url_match(res, add_extension)
+
+
+def split_url_match(res: re.Match, add_extension=None):
+    # parse_url on an already matched REG_URL_NO_PROTOCOL
     parameters = res.group(4)
 
     if res.group(3) is None:
@@ -224,6 +389,42 @@ def parse_url(url, add_extension=None):
     return page_path, page_name
 
 
+@lru_cache(maxsize=URL_CACHE_SIZE)
+def normalize_url(url) -> Url:
+    """
+    Parses url once into an immutable Url record, with the local url of the resource.
+    The records of the last URL_CACHE_SIZE urls are kept, a url being parsed many times
+    over a crawl (once per page linking it, then for its manifest).
+    """
+
+    res = REG_URL_NO_PROTOCOL.search(url)
+    rsc_path, rsc_name = split_url_match(res)
+
+    return Url(url=url,
+               protocol=res.group(1),
+               domain=res.group(2),
+               path=res.group(3),
+               query=res.group(4),
+               local_url="/".join(rsc_path) + "/" + rsc_name)
+
+
+@lru_cache(maxsize=URL_CACHE_SIZE)
+def _is_crawl_allowed(url, allow_crawl_conditions: Tuple[re.Pattern], forbid_crawl_conditions: Tuple[re.Pattern]) -> bool:
+    return all(map(lambda r: r.search(url) is not None, allow_crawl_conditions)) \
+        and all(map(lambda r: r.search(url) is None, forbid_crawl_conditions))
+
+
+def is_crawl_allowed(url,
+                     allow_crawl_conditions: List[re.Pattern] = list(),
+                     forbid_crawl_conditions: List[re.Pattern] = list()) -> bool:
+    """
+    Returns True if url matches every allow condition and none of the forbid conditions.
+    Verdicts are cached like normalize_url, per set of conditions.
+    """
+
+    return _is_crawl_allowed(url, tuple(allow_crawl_conditions), tuple(forbid_crawl_conditions))
+
+
 def find_mimetype(header_content_type: str) -> str:
     res = re.search(r"([^/;]+/[^/;]+)", header_content_type)
     if res:
@@ -233,22 +434,92 @@ def find_mimetype(header_content_type: str) -> str:
         return None
 
 
-def download(url, destination_path, overwrite=True):
-    logging.info(f"Downloading {url} to {destination_path}")
+TEXT_MIMETYPES = {
+    "application/javascript",
+    "application/x-javascript",
+    "application/json",
+    "application/xml",
+    "application/xhtml+xml",
+    "application/rss+xml",
+    "application/atom+xml",
+    "image/svg+xml",
+}
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Attribute of a response holding the encoding decided for it, None being a valid decision
+RESPONSE_ENCODING_ATTRIBUTE = "skydump_encoding"
+_UNDECIDED = object()
 
-    time.sleep(0.20)
 
-    r = requests.get(url)
-    rsc_content = r.content
+def is_text_mimetype(content_type: str) -> bool:
+    return content_type is not None and (content_type.startswith("text/") or content_type in TEXT_MIMETYPES)
+
+
+def get_response_encoding(response: requests.Response):
+    """
+    Returns the encoding of a text response (see CHARSET_DETECTOR), None if it can't be decoded.
+    It is decided once per response and kept on it, parse_page/parse_css then download reading the same response.
+    """
+
+    encoding = getattr(response, RESPONSE_ENCODING_ATTRIBUTE, _UNDECIDED)
+    if encoding is not _UNDECIDED:
+        return encoding
+
+    header_content_type = response.headers.get("Content-Type", "")
+    content_type = find_mimetype(header_content_type) if header_content_type else None
+
+    encoding = CHARSET_DETECTOR.decide(response.content, header_content_type, normalize_url(response.url).domain, content_type)
+    setattr(response, RESPONSE_ENCODING_ATTRIBUTE, encoding)
+    return encoding
+
+
+def get_response_text(response: requests.Response) -> str:
+    # Unlike response.text, never runs the detection over the whole body
+    return response.content.decode(get_response_encoding(response) or "ISO-8859-1", errors="replace")
+
+
+def get_document_encoding(rsc: Resource) -> str:
+    return normalize_charset(rsc.content_encoding) or "ISO-8859-1"
+
+
+def decode_document(data: bytes, rsc: Resource) -> str:
+    """
+    Decodes a downloaded page or stylesheet with its encoding for the rewriters. Bytes the encoding
+    can't decode are kept as is by encode_document, so the parts left untouched are written back unchanged.
+    """
+
+    return data.decode(get_document_encoding(rsc), errors="surrogateescape")
+
+
+def encode_document(content: str, rsc: Resource) -> bytes:
+    return content.encode(get_document_encoding(rsc), errors="surrogateescape")
+
+
+def download(url, destination_path, overwrite=True, response: requests.Response = None):
+    """
+    Writes the resource at url in destination_path, fixing the extension from the Content-Type.
+    Returns the real destination path, the mimetype, the encoding, the status code
+    and the digest of the body.
+
+    The body is streamed to a temporary file then renamed, so memory stays flat whatever
+    the size of the resource. Only textual resources are read at once to detect their encoding.
+    If CONTENT_STORE is set, the file is then deduplicated against the bodies already stored.
+
+    response: already fetched response of the resource, the resource is downloaded if not given
+    """
+
+    logging.info(f"Downloading {url} to {destination_path}")
+
+    r = response if response is not None else fetch(url, stream=True)
 
     if r.status_code != 200:
         logging.error(f"Error code {r.status_code} while getting resource {url}.")
-        return destination_path, None, None, r.status_code
-    
-    logging.info(f"Finished download of {url} to {destination_path}")
+        r.close()
+        return destination_path, None, None, r.status_code, None
 
     content_type = find_mimetype(r.headers["Content-Type"])
-    content_encoding = r.apparent_encoding
+    content_encoding = None
     extension = mimetypes.guess_extension(content_type)
 
     if extension and os.path.splitext(destination_path)[1].lower() != extension:
@@ -256,18 +527,39 @@ def download(url, destination_path, overwrite=True):
     
     if overwrite is False and os.path.exists(destination_path):
         logging.info(f"Resource {destination_path} already exist. Skipping download!")
-    else:
-        with open(destination_path, "wb") as fp:
-            if content_encoding:
-                try:
-                    fp.write(rsc_content.decode(content_encoding).encode(content_encoding))
-                except UnicodeDecodeError as err:
-                    fp.write(rsc_content)
-                    content_encoding = None
-            else:
+        r.close()
+        return destination_path, content_type, content_encoding, r.status_code, None
+
+    body_hash = CONTENT_STORE.new_hash() if CONTENT_STORE is not None else hashlib.sha256()
+    transfer_timer = METRICS.timer("download")
+
+    try:
+        with atomic_path(destination_path) as tmp_path, transfer_timer, open(tmp_path, "wb") as fp:
+            if is_text_mimetype(content_type):
+                # Written as received, the encoding is only recorded for the rewriters
+                rsc_content = r.content
+                content_encoding = get_response_encoding(r)
+
                 fp.write(rsc_content)
+                body_hash.update(rsc_content)
+            else:
+                for chunk in r.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    fp.write(chunk)
+                    body_hash.update(chunk)
+
+    finally:
+        r.close()
+
+    logging.info(f"Finished download of {url} to {destination_path}")
+
+    if METRICS.enabled:
+        METRICS.add_bytes(normalize_url(url).domain, os.path.getsize(destination_path))
+
+    digest = body_hash.hexdigest()
+    if CONTENT_STORE is not None:
+        CONTENT_STORE.add(destination_path, digest)
     
-    return destination_path, content_type, content_encoding, r.status_code
+    return destination_path, content_type, content_encoding, r.status_code, digest
 
 
 def remap_html_page(page_content, origin_local_url, original_url, local_url, relative=True):
@@ -290,242 +582,670 @@ def remap_css_page(page_content, origin_local_url, original_url, local_url, rela
     return page_content
 
 
+def get_link_pairs(links: List[Link]) -> List[Tuple[str, str]]:
+    """
+    Returns the (original url, local url) pairs of links, all the remapping needs to know of them.
+    """
+
+    return [(l.original_url, l.resource.local_url) for l in links]
+
+
+def get_remap_table(origin_local_url, link_pairs: List[Tuple[str, str]], escape=None, relative=True):
+    """
+    Builds the original url -> local url mapping of a document's links.
+    The first link of an original url wins, as it would when replacing the links one after the other.
+    """
+
+    prefix = (len(origin_local_url.split("/"))-1) * "../" if relative else ""
+    escape = escape or (lambda u: u)
+
+    remap_table = {}
+    for original_url, local_url in link_pairs:
+        original_url = escape(original_url)
+        if original_url not in remap_table:
+            remap_table[original_url] = escape(prefix + local_url)
+
+    return remap_table
+
+
+def remap_html_links(page_content, origin_local_url, links: List[Link], relative=True):
+    """
+    Replaces every quoted original url of links by its local url in a single pass over the page.
+    Gives the same result as calling remap_html_page for each link.
+    """
+
+    return remap_html_pairs(page_content, origin_local_url, get_link_pairs(links), relative)
+
+
+def remap_html_pairs(page_content, origin_local_url, link_pairs: List[Tuple[str, str]], relative=True):
+    logging.info(f"Remapping file {origin_local_url} with {len(link_pairs)} links")
+
+    remap_table = get_remap_table(origin_local_url, link_pairs, html.escape, relative)
+    if not remap_table:
+        return page_content
+
+    # Same matches as str.replace of each quoted original url (escaped urls have no quotes): every
+    # span between two consecutive quotes is a candidate, a remapped span consumes its closing quote,
+    # which otherwise opens the next span
+    parts = []
+    last = 0
+    start = page_content.find('"')
+
+    while start != -1:
+        end = page_content.find('"', start + 1)
+        if end == -1:
+            break
+
+        local_url = remap_table.get(page_content[start + 1:end])
+        if local_url is None:
+            start = end
+            continue
+
+        parts.append(page_content[last:start + 1])
+        parts.append(local_url)
+        last = end
+        start = page_content.find('"', end + 1)
+
+    parts.append(page_content[last:])
+
+    return "".join(parts)
+
+
+def remap_css_links(page_content, origin_local_url, links: List[Link], relative=True):
+    """
+    Replaces the url() of every link of a stylesheet by its local url in a single pass.
+    Gives the same result as calling remap_css_page for each link.
+    """
+
+    return remap_css_pairs(page_content, origin_local_url, get_link_pairs(links), relative)
+
+
+def remap_css_pairs(page_content, origin_local_url, link_pairs: List[Tuple[str, str]], relative=True):
+    logging.info(f"Remapping file {origin_local_url} with {len(link_pairs)} links")
+
+    remap_table = get_remap_table(origin_local_url, link_pairs, relative=relative)
+    if not remap_table:
+        return page_content
+
+    def _replace(match):
+        local_url = remap_table.get(match.group(1))
+        return f'url("{local_url}")' if local_url is not None else match.group(0)
+
+    return REG_CSS_URL.sub(_replace, page_content)
+
+
+# Post-processors are run on the whole content of a downloaded document: fn(content, resource) -> content
 PAGE_POST_PROCESSORS = [
-    lambda page_content, p, l: remap_html_page(page_content, p.local_url, l.original_url, l.resource.local_url, relative=True)
+    lambda page_content, p: remap_html_links(page_content, p.local_url, p.links, relative=True)
 ]
 
 CSS_POST_PROCESSORS = [
-    lambda page_content, p, l: remap_css_page(page_content, p.local_url, l.original_url, l.resource.local_url, relative=True)
+    lambda page_content, p: remap_css_links(page_content, p.local_url, p.links, relative=True)
 ]
 
 ASSET_POST_PROCESSORS = {
     "text/css": [
-        lambda p, l: crawl_css(l.resource.remote_url)
+        lambda p, l: CSS_QUEUE.submit(l.resource.remote_url) if CSS_QUEUE is not None else crawl_css(l.resource.remote_url)
     ]
 }
 
 
 def get_resource_local_url(remote_url):
-    rsc_path, rsc_name = parse_url(remote_url)
-    return "/".join(rsc_path) + "/" + rsc_name
+    return normalize_url(remote_url).local_url
+
 
+def retrieve_resource(remote_url, destination_path, overwrite=True, response: requests.Response = None):
+    # Links retrieved concurrently may create the same directory
+    os.makedirs(os.path.dirname(destination_path) or ".", exist_ok=True)
 
-def retrieve_resource(remote_url, destination_path, overwrite=True):
-    destination_dir = os.path.dirname(destination_path)
+    downloaded_file_path, content_type, encoding, return_code, digest = download(remote_url, destination_path, overwrite, response)
+    return downloaded_file_path, content_type, encoding, return_code, digest
 
-    if destination_dir != "" and not os.path.exists(destination_dir):
-        os.makedirs(destination_dir)
 
-    downloaded_file_path, content_type, encoding, return_code = download(remote_url, destination_path, overwrite)
-    return downloaded_file_path, content_type, encoding, return_code
+def read_resource_manifest(path: str):
+    """
+    Returns the content of the manifest at path, None if it doesn't exist.
+    The returned dict is shared and must not be modified.
+    """
+
+    # A buffered manifest is newer than the one on disk
+    rsc_json = MANIFEST_WRITER.get(path)
+    if rsc_json is None:
+        rsc_json = MANIFEST_INDEX.load(path)
+    return rsc_json
 
 
 def open_resource_manifest(path: str):
-    if os.path.exists(path):
-        logging.info(f"Found resource manifest in {path}")
+    rsc_json = read_resource_manifest(path)
+    if rsc_json is not None:
+        if rsc_json.get("type", None) == "page":
+            return Page.load(rsc_json)
+        else:
+            return Resource.load(rsc_json)
 
-        with open(path, "r") as fp:
-            rsc_json = json.load(fp)
-            if rsc_json.get("type", None) == "page":
-                return Page.load(rsc_json)
-            else:
-                return Resource.load(rsc_json)
+
+def get_manifest_path(rsc: Resource):
+    return os.path.dirname(rsc.local_url) + "/" + os.path.basename(get_resource_local_url(rsc.remote_url)) + ".json"
 
 
+@timed("write_manifest")
 def write_resource_manifest(rsc: Resource, path: str = None):
     if path is None:
-        path = os.path.dirname(rsc.local_url) + "/" + os.path.basename(get_resource_local_url(rsc.remote_url)) + ".json"
+        path = get_manifest_path(rsc)
     
     logging.info(f"Writing resource {rsc.remote_url} manifest in {path}")
 
-    if not os.path.exists(os.path.dirname(path)):
-        os.makedirs(os.path.dirname(path))
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
 
-    with open(path, "w") as fp:
-        fp.write(json.dumps(asdict(rsc), indent=4))
+    rsc_json = get_manifest_data(rsc, MANIFEST_WRITER.compact)
 
+    MANIFEST_WRITER.write(path, rsc_json)
 
-def crawl_page(url,
-               allow_crawl_conditions: List[re.Pattern] = list(),
-               forbid_crawl_conditions: List[re.Pattern] = list()):
-    
-    page_local_url = get_resource_local_url(url)
-    page = open_resource_manifest(page_local_url + ".json")
+    MANIFEST_INDEX.update(path, rsc_json)
 
-    if page is None:
-        domain_reg = REG_URL_NO_PROTOCOL.search(url)
-        if not domain_reg:
-            raise Exception(f"Can't parse url: {url}")
+    if STORED_URLS is not None:
+        STORED_URLS.add(rsc.remote_url)
 
-        page = Page(remote_url=url, domain=domain_reg.group(2), protocol=domain_reg.group(1))
 
-    if not page.complete:
-        # Retrieve page and its allowed linked pages & resources
-        page = parse_page(page, allow_crawl_conditions, forbid_crawl_conditions)
-        page.local_url = get_resource_local_url(page.remote_url)
+def fill_stored_urls(root: str = "."):
+    """
+    Adds the url of every manifest under root to STORED_URLS, for an archive crawled without it.
+    """
 
-        # Write first manifest with first infos we do have rn
-        write_resource_manifest(page)
+    n_urls = len(STORED_URLS.add_many(data["remote_url"] for path, data in iter_manifests(root)))
+    STORED_URLS.snapshot()
 
-        # Actually download the page then update the manifest with the real local filepath & info
-        downloaded_file_path, content_type, encoding, return_code = retrieve_resource(page.remote_url, page.local_url)
-        page.content_type = content_type
-        page.local_url = downloaded_file_path
-        page.content_encoding = encoding
-        page.return_code = return_code
+    logging.info(f"Added {n_urls} archived urls to the stored urls")
 
-        write_resource_manifest(page)
 
-        # Backing up original page
-        backup_path = downloaded_file_path + ".orig"
-        if not os.path.exists(backup_path) and os.path.exists(downloaded_file_path) and os.path.isfile(downloaded_file_path):
-            shutil.copyfile(downloaded_file_path, backup_path)
+# Fields of the linked resources kept in compact manifests, the whole resource being in its own manifest
+LINK_REFERENCE_FIELDS = ["type", "protocol", "domain", "remote_url", "local_url", "content_type", "complete"]
 
-    for l in page.links:
-        local_url = get_resource_local_url(l.resource.remote_url)
-        rsc = open_resource_manifest(local_url + ".json")
 
-        if rsc and os.path.exists(rsc.local_url):
+def get_manifest_data(rsc: Resource, compact=False) -> dict:
+    """
+    Returns the content of the manifest of rsc.
+    Compact manifests only keep a reference to the linked resources (see LINK_REFERENCE_FIELDS),
+    they are still loaded by Page.load/Resource.load, the missing fields taking their default value.
+    """
+
+    if not compact:
+        return asdict(rsc)
+
+    rsc_json = {f.name: getattr(rsc, f.name) for f in fields(rsc)}
+    rsc_json["links"] = [{"origin": l.origin,
+                          "original_url": l.original_url,
+                          "resource": {name: getattr(l.resource, name) for name in LINK_REFERENCE_FIELDS}}
+                         for l in rsc.links]
+
+    return rsc_json
+
+
+def archive_resource(rsc: Resource):
+    """
+    Packs a downloaded resource in ARCHIVE, if there's one: its original response, its remapped body
+    for pages and stylesheets, and its manifest. Its files are then removed from the mirror
+    if the archive is set to, the resource being resolved from the archive afterwards.
+    """
+
+    if ARCHIVE is None or not rsc.local_url or not os.path.isfile(rsc.local_url):
+        return
+
+    content_type = f"{rsc.content_type}; charset={rsc.content_encoding}" if rsc.content_encoding else rsc.content_type
+    response_headers = {"Content-Type": content_type, "ETag": rsc.etag, "Last-Modified": rsc.last_modified}
+    http_headers = build_http_response(rsc.return_code, response_headers, b"")
+
+    # Bodies are streamed from the files into the archive, media included, rather than read in memory
+    backup_path = backups.find_backup(rsc.local_url)
+    if backup_path is None:
+        original = FilePayload.from_path(rsc.local_url, http_headers)
+    else:
+        original = FilePayload(lambda: backups.open_backup(backup_path), http_headers,
+                               None if backups.is_compressed(backup_path) else os.path.getsize(backup_path))
+
+    records = [(rsc.remote_url, RESPONSE, original, rsc.local_url, rsc.content_type)]
+
+    if backup_path is not None:
+        records.append((rsc.remote_url, CONVERSION, FilePayload.from_path(rsc.local_url), rsc.local_url, rsc.content_type))
+
+    manifest = get_manifest_data(rsc, MANIFEST_WRITER.compact)
+    records.append((rsc.remote_url, METADATA, json.dumps(manifest).encode("utf-8"), rsc.local_url, "application/json"))
+
+    ARCHIVE.append(records)
+
+    logging.info(f"Packed {rsc.remote_url} in archive {ARCHIVE.root}")
+
+    if ARCHIVE.remove_files:
+        manifest_path = get_manifest_path(rsc)
+        MANIFEST_WRITER.discard(manifest_path)
+        MANIFEST_INDEX.discard(manifest_path)
+
+        backups.remove_backups(rsc.local_url)
+        for path in (rsc.local_url, manifest_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def get_conditional_headers(rsc: Resource):
+    """
+    Returns the headers asking the server to answer 304 Not Modified if the archived copy
+    of rsc is still up to date, None if rsc has no validator or no local file.
+    """
+
+    headers = {}
+    if rsc.etag:
+        headers["If-None-Match"] = rsc.etag
+    if rsc.last_modified:
+        headers["If-Modified-Since"] = rsc.last_modified
+
+    if not headers or not rsc.local_url or not os.path.exists(rsc.local_url):
+        return None
+
+    return headers
+
+
+def set_validators(rsc: Resource, response: requests.Response):
+    """
+    Records the validators of the response in the resource, to revalidate it on the next crawl.
+    """
+
+    rsc.etag = response.headers.get("ETag", "")
+    rsc.last_modified = response.headers.get("Last-Modified", "")
+
+    content_length = response.headers.get("Content-Length", "")
+    rsc.content_length = int(content_length) if content_length.isdigit() else -1
+
+
+def is_not_modified(rsc: Resource, response: requests.Response):
+    if response.status_code != 304:
+        return False
+
+    logging.info(f"Resource {rsc.remote_url} not modified, keeping {rsc.local_url}")
+    response.close()
+    return True
+
+
+def read_original(rsc: Resource):
+    """
+    Reads back the original content of a downloaded page or stylesheet from the archive,
+    from its backup if it has already been remapped.
+    """
+
+    data = backups.read_backup(rsc.local_url)
+    if data is None:
+        with open(rsc.local_url, "rb") as fp:
+            data = fp.read()
+
+    return data.decode(get_document_encoding(rsc), errors="replace")
+
+
+def load_resource(url, rsc_class=Resource):
+    """
+    Returns the resource stored in the manifest of url if it exists,
+    a new rsc_class instance otherwise.
+    """
+
+    rsc = None
+
+    # A url never stored has no manifest, in the mirror or in the archive
+    is_stored = STORED_URLS is None or STORED_URLS.might_contain(url)
+
+    if is_stored:
+        rsc = open_resource_manifest(get_resource_local_url(url) + ".json")
+
+    if rsc is None and is_stored and ARCHIVE is not None:
+        rsc_json = ARCHIVE.read_manifest(url)
+        if rsc_json is not None:
+            rsc = Page.load(rsc_json) if rsc_json.get("type", None) == "page" else Resource.load(rsc_json)
+
+    if rsc is None:
+        rsc_url = normalize_url(url)
+        rsc = rsc_class(remote_url=url, domain=rsc_url.domain, protocol=rsc_url.protocol)
+
+    return rsc
+
+
+def store_resource(rsc: Resource, response: requests.Response, overwrite_backup=False):
+    """
+    Writes an already parsed page or stylesheet and its manifests on disk from its response,
+    then backs up the original file before it gets remapped.
+
+    overwrite_backup: replace an existing backup (when the resource has changed since it was archived)
+    """
+
+    rsc.local_url = get_resource_local_url(rsc.remote_url)
+
+    # Write first manifest with first infos we do have rn
+    write_resource_manifest(rsc)
+
+    # Write the resource on disk then update the manifest with the real local filepath & info
+    downloaded_file_path, content_type, encoding, return_code, digest = retrieve_resource(rsc.remote_url, rsc.local_url,
+                                                                                          response=response)
+    # Only interned by the constructor, as the fields read back from the manifests
+    rsc.content_type = intern_str(content_type)
+    rsc.local_url = downloaded_file_path
+    rsc.content_encoding = intern_str(encoding)
+    rsc.return_code = return_code
+    rsc.digest = digest or rsc.digest
+    set_validators(rsc, response)
+
+    write_resource_manifest(rsc)
+
+    # Backing up original page
+    backups.write_backup(downloaded_file_path, BACKUP_STRATEGY, overwrite_backup)
+
+    return rsc
+
+
+def resolve_link(l: Link):
+    """
+    Points the link to the already downloaded resource if its manifest exists.
+    Returns False if the resource still has to be downloaded.
+    """
+
+    local_url = get_resource_local_url(l.resource.remote_url)
+
+    # A url never stored has no manifest, in the mirror or in the archive
+    if STORED_URLS is not None and not STORED_URLS.might_contain(l.resource.remote_url):
+        l.resource = replace(l.resource, local_url=local_url)
+        return False
+
+    # The index knows without touching the disk whether the resource has already been downloaded
+    if MANIFEST_INDEX.get_local_url(local_url + ".json") is not None:
+        # Every link to the url gets the same resource, loaded once
+        l.resource = RESOURCE_REGISTRY.load(read_resource_manifest(local_url + ".json"))
+        return True
+
+    # The file is missing but its body may already be in the content store
+    if CONTENT_STORE is not None:
+        rsc = open_resource_manifest(local_url + ".json")
+        if rsc and rsc.local_url and CONTENT_STORE.restore(rsc.digest, rsc.local_url):
+            write_resource_manifest(rsc)
             l.resource = rsc
+            return True
+
+    # Or it has been packed in the archive
+    if ARCHIVE is not None:
+        rsc_json = ARCHIVE.read_manifest(l.resource.remote_url)
+        if rsc_json is not None:
+            l.resource = RESOURCE_REGISTRY.load(rsc_json)
+            return True
+
+    # The placeholder is shared with the other links to the url (see RESOURCE_REGISTRY), the link gets its own copy
+    l.resource = replace(l.resource, local_url=local_url)
+    return False
+
+
+def store_link(l: Link, response: requests.Response = None, overwrite=False):
+    """
+    Downloads the resource of an unresolved link (or writes it from its response)
+    and writes its manifest.
+    """
+
+    if response is None:
+        response = fetch(l.resource.remote_url, stream=True)
+
+    downloaded_file_path, content_type, encoding, return_code, digest = retrieve_resource(l.resource.remote_url,
+                                                                                          l.resource.local_url,
+                                                                                          overwrite=overwrite,
+                                                                                          response=response)
+    
+    # Updating the local_url field with the real local url of thed ownloaded file
+    # (to integrate corrected extension detected from the mimetype)
+    # The resource may be shared with other links (see RESOURCE_REGISTRY), a copy is updated
+    rsc = replace(l.resource,
+                  local_url=downloaded_file_path,
+                  content_type=content_type,
+                  content_encoding=encoding,
+                  return_code=return_code,
+                  digest=digest or l.resource.digest)
+    set_validators(rsc, response)
+
+    # If we just downloaded an html page (badly detected because it was not in a <a> link),
+    # We upgrade it as a Page
+    if content_type == "text/html":
+        rsc = Page(**{f.name: getattr(rsc, f.name) for f in fields(rsc)})
+        rsc.type = "page"
+
+    l.resource = rsc
+
+    write_resource_manifest(l.resource)
+
+    # Stylesheets are packed once crawled and remapped
+    if content_type != "text/css":
+        archive_resource(l.resource)
+
+    return l
+
+
+def revalidate_link(l: Link):
+    """
+    Downloads the resource of a resolved link again only if it has changed since it was archived.
+    A resource shared by many pages is only revalidated once (see REVALIDATED_URLS).
+    """
+
+    if l.resource.remote_url in REVALIDATED_URLS:
+        return l
+    REVALIDATED_URLS.add(l.resource.remote_url)
+
+    # Post-processed documents must not be overwritten with their raw content,
+    # they are refreshed by crawling them again (pages through the crawl loop)
+    if l.resource.complete:
+        if l.resource.content_type == "text/css":
+            l.resource = crawl_css(l.resource.remote_url, revalidate=True)
+        return l
+
+    response = fetch(l.resource.remote_url, stream=True, headers=get_conditional_headers(l.resource))
+    if is_not_modified(l.resource, response):
+        return l
+
+    return store_link(l, response, overwrite=True)
+
+
+def retrieve_link(l: Link, revalidate=False):
+    """
+    Points the link to its archived resource, downloading it if needed.
+    """
+
+    if not resolve_link(l):
+        if SHARED_ASSETS is not None and SHARED_ASSETS.is_shared(l.resource.remote_url):
+            retrieve_shared_link(l)
         else:
-            l.resource.local_url = local_url
+            store_link(l)
+    elif revalidate:
+        revalidate_link(l)
 
-            downloaded_file_path, content_type, encoding, return_code = retrieve_resource(l.resource.remote_url,
-                                                                                          local_url,
-                                                                                          overwrite=False)
-            
-            # Updating the local_url field with the real local url of thed ownloaded file
-            # (to integrate corrected extension detected from the mimetype)
-            l.resource.local_url = downloaded_file_path
-            l.resource.content_type = content_type
-            l.resource.content_encoding = encoding
-            l.resource.return_code = return_code
+    return l
 
-            # If we just downloaded an html page (badly detected because it was not in a <a> link),
-            # We upgrade it as a Page
-            if content_type == "text/html":
-                l.resource = Page(**asdict(l.resource))
-                l.resource.type = "page"
 
-            write_resource_manifest(l.resource)
+def retrieve_shared_link(l: Link):
+    """
+    Downloads the resource of a host shared between the workers of a sharded crawl,
+    unless another worker downloads it, in which case its manifest is read once it is done.
+    """
 
-    # Run post-process operations
-    if not page.complete:
-        if os.path.exists(page.local_url) and os.path.isfile(page.local_url):
-            local_file_content = None
-            with open(page.local_url, "rb") as fp:
-                local_file_content = fp.read().decode("ISO-8859-1")
-            
-            for link in page.links:
-                for fn in PAGE_POST_PROCESSORS:
-                    local_file_content = fn(local_file_content, page, link)
+    url = l.resource.remote_url
+    manifest_path = get_resource_local_url(url) + ".json"
+
+    while not SHARED_ASSETS.claim(url):
+        if not SHARED_ASSETS.wait(url):
+            # Given up by the other worker, claim it again
+            continue
+
+        # Written by another process, the index may remember it as missing
+        try:
+            with open(manifest_path, "r") as fp:
+                rsc_json = json.load(fp)
+        except (OSError, ValueError):
+            rsc_json = None
+
+        if rsc_json is not None and rsc_json.get("local_url") and os.path.exists(rsc_json["local_url"]):
+            MANIFEST_INDEX.update(manifest_path, rsc_json)
+            l.resource = RESOURCE_REGISTRY.load(rsc_json)
+            return l
 
-            with open(page.local_url, "wb") as fp:
-                fp.write(local_file_content.encode("ISO-8859-1"))
+        logging.warning(f"Shared resource {url} is missing, downloading it again")
+        break
 
+    try:
+        store_link(l)
+        # The other workers read the manifest as soon as the resource is done
+        MANIFEST_WRITER.flush()
+    except BaseException:
+        SHARED_ASSETS.release(url)
+        raise
+
+    SHARED_ASSETS.done(url)
+
+    return l
+
+
+def apply_post_processors(post_processors, content, rsc: Resource, rewrite=None):
+    """
+    Runs the document post-processors (or rewrite, if given) on the content of rsc.
+    """
+
+    if rewrite is not None:
+        return rewrite(content, rsc)
+
+    for fn in post_processors:
+        content = fn(content, rsc)
+
+    return content
+
+
+def post_process_page(page: Page, run_asset_post_processors=True, rewrite=None):
+    """
+    Remaps the links of a downloaded page to their local files, runs the asset post-processors
+    and marks the page as complete.
+
+    rewrite: fn(content, page) -> content replacing the PAGE_POST_PROCESSORS (eg. ParsePool.rewrite_page)
+    """
+
+    if os.path.exists(page.local_url) and os.path.isfile(page.local_url):
+        local_file_content = None
+        with open(page.local_url, "rb") as fp:
+            local_file_content = decode_document(fp.read(), page)
+        
+        with METRICS.timer("remap_page"):
+            local_file_content = apply_post_processors(PAGE_POST_PROCESSORS, local_file_content, page, rewrite)
+
+        replace_file_content(page.local_url, encode_document(local_file_content, page))
+
+        if run_asset_post_processors:
             for link in page.links:
                 fn_list = ASSET_POST_PROCESSORS.get(link.resource.content_type, [])
                 for fn in fn_list:
                     fn(page, link)
 
-            page.complete = True
+        page.complete = True
 
-        # Hardcode strip of linked pages links to avoid filling manifests with nested pages
-        for l in page.links:
-            if isinstance(l.resource, Page):
-                l.resource.links = []
+    # Hardcode strip of linked pages links to avoid filling manifests with nested pages
+    for l in page.links:
+        if isinstance(l.resource, Page) and l.resource.links:
+            l.resource = replace(l.resource, links=[])
 
-        write_resource_manifest(page)
+    write_resource_manifest(page)
 
-    return page
+    if page.complete:
+        archive_resource(page)
 
+    return page
 
-def crawl_css(url):
-    page_local_url = get_resource_local_url(url)
-    css_rsc = open_resource_manifest(page_local_url + ".json")
 
-    if css_rsc is None:
-        domain_reg = REG_URL_NO_PROTOCOL.search(url)
-        if not domain_reg:
-            raise Exception(f"Can't parse url: {url}")
+def post_process_css(css_rsc: Resource, rewrite=None):
+    """
+    Remaps the links of a downloaded stylesheet to their local files and marks it as complete.
 
-        css_rsc = Resource(remote_url=url, domain=domain_reg.group(2), protocol=domain_reg.group(1))
+    rewrite: fn(content, css_rsc) -> content replacing the CSS_POST_PROCESSORS (eg. ParsePool.rewrite_css)
+    """
 
-    if not css_rsc.complete:
-        # Retrieve page and its allowed linked pages & resources
-        css_rsc = parse_css(css_rsc)
-        css_rsc.local_url = get_resource_local_url(css_rsc.remote_url)
+    local_file_content = None
 
-        # Write first manifest with first infos we do have rn
-        write_resource_manifest(css_rsc)
+    with open(css_rsc.local_url, "rb") as fp:
+        local_file_content = decode_document(fp.read(), css_rsc)
 
-        # Actually download the page then update the manifest with the real local filepath & info
-        downloaded_file_path, content_type, encoding, return_code = retrieve_resource(css_rsc.remote_url, css_rsc.local_url)
-        css_rsc.content_type = content_type
-        css_rsc.local_url = downloaded_file_path
-        css_rsc.content_encoding = encoding
-        css_rsc.return_code = return_code
+    with METRICS.timer("remap_css"):
+        local_file_content = apply_post_processors(CSS_POST_PROCESSORS, local_file_content, css_rsc, rewrite)
 
-        write_resource_manifest(css_rsc)
+    replace_file_content(css_rsc.local_url, encode_document(local_file_content, css_rsc))
+    
+    #for link in css_rsc.links:
+    #    fn_list = ASSET_POST_PROCESSORS.get(link.resource.content_type, [])
+    #    for fn in fn_list:
+    #        fn(css_rsc, link)
 
-        # Backing up original page
-        backup_path = downloaded_file_path + ".orig"
-        if not os.path.exists(backup_path) and os.path.exists(downloaded_file_path):
-            shutil.copyfile(downloaded_file_path, backup_path)
+    css_rsc.complete = True
 
+    # Hardcode strip of linked pages links to avoid filling manifests with nested pages
     for l in css_rsc.links:
-        local_url = get_resource_local_url(l.resource.remote_url)
-        rsc = open_resource_manifest(local_url + ".json")
+        if isinstance(l.resource, Page) and l.resource.links:
+            l.resource = replace(l.resource, links=[])
 
-        if rsc and os.path.exists(rsc.local_url):
-            l.resource = rsc
+    write_resource_manifest(css_rsc)
+
+    archive_resource(css_rsc)
+
+    return css_rsc
+
+
+@timed("crawl_page")
+def crawl_page(url,
+               allow_crawl_conditions: List[re.Pattern] = list(),
+               forbid_crawl_conditions: List[re.Pattern] = list(),
+               revalidate=False):
+    """
+    revalidate: refresh an already archived page and its resources, only downloading
+                again what has changed (ETag/Last-Modified revalidation)
+    """
+    
+    page = load_resource(url, Page)
+
+    if not page.complete or revalidate:
+        # Fetch the page only once, the same response is used for parsing and saving
+        response = fetch(page.remote_url, headers=get_conditional_headers(page) if revalidate else None)
+
+        if is_not_modified(page, response):
+            # Links are read back from the archived page if it hasn't been remapped yet
+            if not page.complete:
+                page = parse_page(page, allow_crawl_conditions, forbid_crawl_conditions, html_doc=read_original(page))
         else:
-            l.resource.local_url = local_url
+            # Retrieve page and its allowed linked pages & resources
+            page.complete = False
+            page = parse_page(page, allow_crawl_conditions, forbid_crawl_conditions, response)
+            page = store_resource(page, response, overwrite_backup=revalidate)
 
-            downloaded_file_path, content_type, encoding, return_code = retrieve_resource(l.resource.remote_url,
-                                                                                          local_url,
-                                                                                          overwrite=False)
-            
-            # Updating the local_url field with the real local url of thed ownloaded file
-            # (to integrate corrected extension detected from the mimetype)
-            l.resource.local_url = downloaded_file_path
-            l.resource.content_type = content_type
-            l.resource.content_encoding = encoding
-            l.resource.return_code = return_code
+    ASSET_FETCHER.retrieve(lambda l: retrieve_link(l, revalidate), page.links)
 
-            # If we just downloaded an html page (badly detected because it was not in a <a> link),
-            # We upgrade it as a Page
-            if content_type == "text/html":
-                l.resource = Page(**asdict(l.resource))
-                l.resource.type = "page"
+    # Run post-process operations
+    if not page.complete:
+        page = post_process_page(page)
 
-            write_resource_manifest(l.resource)
+    METRICS.count("pages")
 
-    if not css_rsc.complete:
-        local_file_content = None
+    return page
 
-        with open(css_rsc.local_url, "r") as fp:
-            local_file_content = fp.read()
 
-        for link in css_rsc.links:
-            for fn in CSS_POST_PROCESSORS:
-                local_file_content = fn(local_file_content, css_rsc, link)
+@timed("crawl_css")
+def crawl_css(url, revalidate=False):
+    css_rsc = load_resource(url, Resource)
 
-        with open(css_rsc.local_url, "w") as fp:
-            fp.write(local_file_content)
-        
-        #for link in css_rsc.links:
-        #    fn_list = ASSET_POST_PROCESSORS.get(link.resource.content_type, [])
-        #    for fn in fn_list:
-        #        fn(css_rsc, link)
+    if not css_rsc.complete or revalidate:
+        # Fetch the stylesheet only once, the same response is used for parsing and saving
+        response = fetch(css_rsc.remote_url, headers=get_conditional_headers(css_rsc) if revalidate else None)
 
-        css_rsc.complete = True
+        if is_not_modified(css_rsc, response):
+            if not css_rsc.complete:
+                css_rsc = parse_css(css_rsc, css_doc=read_original(css_rsc))
+        else:
+            # Retrieve page and its allowed linked pages & resources
+            css_rsc.complete = False
+            css_rsc = parse_css(css_rsc, response)
+            css_rsc = store_resource(css_rsc, response, overwrite_backup=revalidate)
 
-        # Hardcode strip of linked pages links to avoid filling manifests with nested pages
-        for l in css_rsc.links:
-            if isinstance(l.resource, Page):
-                l.resource.links = []
+    ASSET_FETCHER.retrieve(lambda l: retrieve_link(l, revalidate), css_rsc.links)
 
-        write_resource_manifest(css_rsc)
+    if not css_rsc.complete:
+        css_rsc = post_process_css(css_rsc)
 
     return css_rsc
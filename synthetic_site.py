@@ -0,0 +1,189 @@
+import time
+import random
+import logging
+import threading
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class SyntheticSite:
+    """
+    Local http server serving a generated blog shaped like a Skyrock one, to benchmark the crawler
+    offline: paginated /N.html pages listing articles, article pages, images and stylesheets whose
+    url() point to more images. The content only depends on the parameters, so two runs crawl the
+    exact same site.
+
+    pages: number of paginated pages (/1.html to /N.html, / being the first one)
+    articles_per_page: number of articles listed on each page, each having its own page
+    assets_per_article: number of images of each article
+    asset_size: size of each image in bytes
+    page_padding: bytes of text added to each page and article
+    css_files: number of stylesheets linked by every page
+    css_urls: number of url() in each stylesheet
+    latency: seconds waited before answering each request
+    port: port to listen on, 0 for any free port
+    """
+
+    def __init__(self,
+                 pages: int = 20,
+                 articles_per_page: int = 5,
+                 assets_per_article: int = 4,
+                 asset_size: int = 20000,
+                 page_padding: int = 20000,
+                 css_files: int = 2,
+                 css_urls: int = 20,
+                 latency: float = 0.0,
+                 port: int = 0):
+        self.pages = pages
+        self.articles_per_page = articles_per_page
+        self.assets_per_article = assets_per_article
+        self.asset_size = asset_size
+        self.page_padding = page_padding
+        self.css_files = css_files
+        self.css_urls = css_urls
+        self.latency = latency
+        self.port = port
+
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def page_count(self) -> int:
+        # Paginated pages, articles and the root page
+        return self.pages * (self.articles_per_page + 1) + 1
+
+    def _head(self) -> str:
+        stylesheets = "".join(f'<link rel="stylesheet" type="text/css" href="{self.url}/css/blog-{k}.css">'
+                              for k in range(self.css_files))
+        return f'<head><meta http-equiv="Content-Type" content="text/html; charset=utf-8">{stylesheets}</head>'
+
+    def _padding(self, seed: int) -> str:
+        rnd = random.Random(seed)
+        words = ["skyblog", "trop", "bien", "lol", "mdr", "été", "vacances", "amis", "musique", "photo"]
+        text = []
+        size = 0
+        while size < self.page_padding:
+            word = rnd.choice(words)
+            text.append(word)
+            size += len(word.encode("utf-8")) + 1
+        return f'<div class="text">{" ".join(text)}</div>'
+
+    def _article_block(self, article_id: int) -> str:
+        images = "".join(f'<img src="{self.url}/img/{article_id}-{k}.jpg" alt="">'
+                         for k in range(self.assets_per_article))
+        return f'<div class="article"><a href="/{article_id}-article.html">Article {article_id}</a>{images}</div>'
+
+    @lru_cache(maxsize=None)
+    def page(self, n: int) -> bytes:
+        # Pagination as on the blogs: first, neighbours and last pages
+        shown = sorted({1, max(1, n - 2), max(1, n - 1), n, min(self.pages, n + 1), min(self.pages, n + 2), self.pages})
+        pagination = "".join(f'<a href="/{k}.html">{k}</a>' for k in shown)
+        articles = "".join(self._article_block(n * 1000 + k) for k in range(self.articles_per_page))
+
+        return (f'<html>{self._head()}<body><div id="pagination">{pagination}</div>{articles}'
+                f'{self._padding(n)}</body></html>').encode("utf-8")
+
+    @lru_cache(maxsize=None)
+    def article(self, article_id: int) -> bytes:
+        n = article_id // 1000
+        return (f'<html>{self._head()}<body><a href="/{n}.html">Retour</a>{self._article_block(article_id)}'
+                f'{self._padding(article_id)}</body></html>').encode("utf-8")
+
+    @lru_cache(maxsize=None)
+    def stylesheet(self, k: int) -> bytes:
+        rules = []
+        for i in range(self.css_urls):
+            # Relative, root relative and absolute urls, as found in the blog stylesheets
+            if i % 3 == 0:
+                url = f"../img/bg-{k}-{i}.png"
+            elif i % 3 == 1:
+                url = f"'/img/bg-{k}-{i}.png'"
+            else:
+                url = f'"{self.url}/img/bg-{k}-{i}.png"'
+            rules.append(f".c{k}-{i} {{ background: url({url}) no-repeat; }}")
+        return "\n".join(rules).encode("utf-8")
+
+    def image(self, name: str) -> bytes:
+        return random.Random(name).randbytes(self.asset_size)
+
+    def get(self, path: str):
+        """
+        Returns (content type, body) of the resource at path, None if there is none.
+        """
+
+        path = path.split("?")[0]
+        name = path.rsplit("/", 1)[-1]
+
+        try:
+            if path == "/":
+                return "text/html; charset=utf-8", self.page(1)
+
+            if path.startswith("/img/") and (name.endswith(".jpg") or name.endswith(".png")):
+                return ("image/jpeg" if name.endswith(".jpg") else "image/png"), self.image(name)
+
+            if path.startswith("/css/blog-") and name.endswith(".css"):
+                k = int(name[len("blog-"):-len(".css")])
+                if k < self.css_files:
+                    return "text/css", self.stylesheet(k)
+
+            elif path.count("/") == 1 and name.endswith("-article.html"):
+                article_id = int(name[:-len("-article.html")])
+                if 1 <= article_id // 1000 <= self.pages and article_id % 1000 < self.articles_per_page:
+                    return "text/html; charset=utf-8", self.article(article_id)
+
+            elif path.count("/") == 1 and name.endswith(".html"):
+                n = int(name[:-len(".html")])
+                if 1 <= n <= self.pages:
+                    return "text/html; charset=utf-8", self.page(n)
+
+        except ValueError:
+            pass
+
+        return None
+
+    def _make_handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                if site.latency:
+                    time.sleep(site.latency)
+
+                resource = site.get(self.path)
+                if resource is None:
+                    self.send_error(404)
+                    return
+
+                content_type, body = resource
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.port), self._make_handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+        logging.info(f"Serving a synthetic site of {self.page_count} pages on {self.url}")
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -1,11 +1,27 @@
 import re
 import logging
+import argparse
 
 from dataclasses import asdict
 
 from skydump import parse_page, parse_css, find_mimetype
 from skydump import parse_url, crawl_page, crawl_css, open_resource_manifest
 from skydump import download, get_resource_local_url, remap_html_page
+from skydump import normalize_url, is_crawl_allowed
+
+import engine
+import skydump
+from frontier import Frontier
+from blog_seeder import BlogSeeder
+from seen_set import SeenSet
+from shards import ShardQueue, run_worker
+from css_queue import CssQueue
+from manifest_writer import ManifestWriter
+from content_store import ContentStore
+from archive import Archive
+from metrics import Metrics
+import backups
+from session import create_session
 
 
 logging.getLogger().setLevel(logging.INFO)
@@ -68,42 +84,132 @@ FORBID_CRAWL_CONDITIONS = [
 
 #download("https://pips.skyrock.com/", "test.html")
 
-REG_URL_NO_PROTOCOL = re.compile(r"^([a-zA-Z]+://)?([^\/]*)(\/[^?]*)?(\?.*)?", re.I)
-
 START_URL = "https://xxzevent2020xx.skyrock.com/"
 
-already_crawled = set()
-to_crawl = [START_URL]
+parser = argparse.ArgumentParser(description=f"Crawls {START_URL}")
+parser.add_argument("worker", nargs="?", help="crawl as one of the workers sharing shards.db, each in its own output root")
+parser.add_argument("--backoff", type=float, default=skydump.RATE_LIMITER.backoff,
+                    help="seconds a host answering 429/503 without Retry-After is paused, doubled each time")
+parser.add_argument("--max-backoff", type=float, default=skydump.RATE_LIMITER.max_backoff,
+                    help="bound of the back-off delay")
+args = parser.parse_args()
+
+# Crawl as one of the workers sharing shards.db, each in its own output root: python test.py <worker name>
+SHARD_WORKER = args.worker
+
+skydump.RATE_LIMITER.backoff = args.backoff
+skydump.RATE_LIMITER.max_backoff = args.max_backoff
+
+# Store identical bodies only once, the mirror files being hardlinks to them
+#skydump.CONTENT_STORE = ContentStore("_objects")
+
+# Pack the crawled resources in WARC segments instead of 3 files each (python archive.py extract|serve to read them)
+#skydump.ARCHIVE = Archive("_archive")
+
+# Originals of the remapped pages are hardlinked by default, backups.GZIP/ZSTD compress them, backups.NONE skips them
+#skydump.BACKUP_STRATEGY = backups.GZIP
+
+# Load the manifests of the archive once, links are then resolved in memory (a worker loads its own root)
+if SHARD_WORKER is None:
+    skydump.MANIFEST_INDEX.scan(".")
+
+# For the whole blog space, only keep the stored urls, in a Bloom filter backed by SQLite, instead of scanning
+#skydump.STORED_URLS = SeenSet("stored_urls.db", capacity=50000000)
+#if not len(skydump.STORED_URLS):
+#    skydump.fill_stored_urls(".")
+
+# Manifests are written minified and in batches, flushed once each page is crawled
+skydump.MANIFEST_WRITER = ManifestWriter(batch_size=256, compact=True)
+
+# Log the throughput and the time spent per stage every 30s, and append it to metrics.jsonl
+skydump.METRICS = Metrics(report_interval=30, export_path="metrics.jsonl")
+
+# Queued and crawled urls are persisted, a killed crawl resumes where it stopped
+frontier = Frontier("frontier.db")
+frontier.add([START_URL])
+
+# Refresh the whole archive, only downloading again what has changed since the last crawl
+REVALIDATE = False
+if REVALIDATE:
+    frontier.requeue()
+
+# Stylesheets are crawled once each in the background, pages don't wait for them
+skydump.CSS_QUEUE = CssQueue(crawl_css)
+
+# Queue all the paginated pages of a blog as soon as its first page is crawled
+seeder = BlogSeeder()
+
+
+user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/116.0"
+
+skydump.SESSION = create_session(headers={"User-Agent": user_agent},
+                                 timeout=(10, 60),
+                                 pool_maxsize=8,
+                                 host_pool_sizes={
+                                     "https://static.skyrock.net/": 16,
+                                     "https://i.skyrock.net/": 16,
+                                 })
+
+USE_ASYNC_ENGINE = False
+
+
+def is_crawlable_page(rsc):
+    return rsc.type == "page" \
+        and "connect=1" not in rsc.remote_url \
+        and is_crawl_allowed(rsc.remote_url, ALLOW_CRAWL_CONDITIONS, FORBID_CRAWL_CONDITIONS)
+
+
+if SHARD_WORKER is not None:
+    shard_queue = ShardQueue("shards.db")
+    shard_queue.add([START_URL])
+
+    run_worker(shard_queue,
+               SHARD_WORKER,
+               f"workers/{SHARD_WORKER}",
+               "workers/_shared",
+               ALLOW_CRAWL_CONDITIONS,
+               FORBID_CRAWL_CONDITIONS,
+               page_filter=is_crawlable_page)
+
+elif USE_ASYNC_ENGINE:
+    engine.crawl([START_URL],
+                 ALLOW_CRAWL_CONDITIONS,
+                 FORBID_CRAWL_CONDITIONS,
+                 page_filter=is_crawlable_page,
+                 max_concurrency=16,
+                 per_host_concurrency=4,
+                 frontier=frontier,
+                 revalidate=REVALIDATE,
+                 seeder=seeder,
+                 lazy_css=True)
 
+else:
+    curr_domain = None
 
-#user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/116.0"
+    while True:
+        # Pages of the domain being crawled are taken first
+        url = frontier.pop(curr_domain)
+        if url is None:
+            break
 
+        print(f"---- GETTING PAGE {url} ----")
+        page = crawl_page(url, ALLOW_CRAWL_CONDITIONS, FORBID_CRAWL_CONDITIONS, revalidate=REVALIDATE)
 
-while len(to_crawl) > 0:
-    url = to_crawl.pop(0)
+        # The manifests of the page must be on disk before it is recorded as done
+        skydump.MANIFEST_WRITER.flush()
+        discovered_pages = [l.resource for l in page.links] + seeder.seed(page)
+        frontier.done(url, [rsc.remote_url for rsc in discovered_pages if is_crawlable_page(rsc)])
 
-    with open("to_crawl.txt", "w") as fp:
-        fp.write("\n".join(to_crawl))
+        curr_domain = normalize_url(url).domain
 
-    print(f"---- GETTING PAGE {url} ----")
-    page = crawl_page(url, ALLOW_CRAWL_CONDITIONS, FORBID_CRAWL_CONDITIONS)
-    already_crawled.add(url)
+        if skydump.METRICS.enabled:
+            skydump.METRICS.set_queue_depth(len(frontier))
+            skydump.METRICS.tick()
 
-    for l in page.links:
-        if l.resource.remote_url not in already_crawled \
-            and l.resource.remote_url not in to_crawl \
-            and l.resource.type == "page" \
-            and "connect=1" not in l.resource.remote_url \
-            and all(map(lambda r: r.search(l.resource.remote_url) is not None, ALLOW_CRAWL_CONDITIONS)) and all(map(lambda r: r.search(l.resource.remote_url) is None, FORBID_CRAWL_CONDITIONS)):
+    skydump.CSS_QUEUE.finalize()
+    skydump.MANIFEST_WRITER.flush()
 
-            to_crawl.append(l.resource.remote_url)
-    
-    url_reg = REG_URL_NO_PROTOCOL.search(url)
-    if not url_reg:
-        raise Exception(f"Can't parse resource url: {url}")
-    
-    curr_domain = url_reg.group(1) + url_reg.group(2)
-    to_crawl = sorted(to_crawl, key=lambda u: u.startswith(curr_domain), reverse=True)
+    skydump.METRICS.report()
 
 
 #css_rsc = crawl_css("https://static.skyrock.net/css/blogs/120.css?eSaHpY_93")
@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+import backups
+from archive import Archive, FilePayload, RESPONSE, CONVERSION, build_http_response
+
+
+class FailingPayload(FilePayload):
+    def chunks(self):
+        yield b"partial"
+        raise IOError("read error")
+
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_streamed_records(tmp_path, compress):
+    body = os.urandom(300_000)
+    (tmp_path / "media.bin").write_bytes(body)
+    page = tmp_path / "page.html"
+    page.write_bytes(b"<html>original</html>")
+    backup_path = backups.write_backup(str(page), backups.GZIP)
+    page.write_bytes(b"<html>remapped</html>")
+
+    archive = Archive(str(tmp_path / "archive"), compress=compress)
+    http_headers = build_http_response(200, {"Content-Type": "text/html"}, b"")
+    archive.append([
+        ("http://x/media.bin", RESPONSE, FilePayload.from_path(str(tmp_path / "media.bin")), "media.bin", "image/png"),
+        ("http://x/page.html", RESPONSE, FilePayload(lambda: backups.open_backup(backup_path), http_headers), "page.html", "text/html"),
+        ("http://x/page.html", CONVERSION, FilePayload.from_path(str(page)), "page.html", "text/html"),
+    ])
+
+    assert archive.read("http://x/media.bin") == body
+    assert archive.read("http://x/page.html") == http_headers + b"<html>original</html>"
+    assert archive.read_local("page.html")[0] == b"<html>remapped</html>"
+
+    rows = archive.connection.execute("SELECT url, type, offset, length FROM records ORDER BY seq").fetchall()
+    archive.reindex()
+    assert archive.connection.execute("SELECT url, type, offset, length FROM records ORDER BY seq").fetchall() == rows
+    archive.close()
+
+
+def test_failed_append_is_dropped(tmp_path):
+    archive = Archive(str(tmp_path / "archive"))
+    archive.append([("http://x/a", RESPONSE, b"a", "a", "text/plain")])
+    segment_path = os.path.join(archive.root, archive._segment_name)
+    size = os.path.getsize(segment_path)
+
+    with pytest.raises(IOError):
+        archive.append([("http://x/b", RESPONSE, b"b", "b", "text/plain"),
+                        ("http://x/c", RESPONSE, FailingPayload(None, size=100), "c", "text/plain")])
+
+    assert os.path.getsize(segment_path) == size
+    assert archive.read("http://x/b") is None
+
+    archive.append([("http://x/d", RESPONSE, b"d", "d", "text/plain")])
+    archive.reindex()
+    assert archive.read("http://x/a") == b"a"
+    assert archive.read("http://x/d") == b"d"
+    archive.close()
@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+import extractors
+from extractors import SoupExtractor, get_extractor, get_links
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+PAGES = sorted(name for name in os.listdir(FIXTURES) if name.endswith(".html"))
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), "rb") as fp:
+        return fp.read().decode("ISO-8859-1")
+
+
+@pytest.mark.parametrize("page", PAGES)
+@pytest.mark.parametrize("extractor_name", [
+    "tokenizer",
+    pytest.param("lxml", marks=pytest.mark.skipif(extractors.lxml is None, reason="lxml is not installed")),
+])
+def test_extractor_parity(extractor_name, page):
+    html_doc = read_fixture(page)
+
+    reference_links = get_links(SoupExtractor(), html_doc)
+    links = get_links(get_extractor(extractor_name), html_doc)
+
+    assert reference_links
+    assert sorted(links) == sorted(reference_links)
+
+
+def test_tricky_links():
+    links = {original_url for original_url, _, _ in get_links(SoupExtractor(), read_fixture("tricky.html"))}
+
+    # Unquoted attributes and upper case tags are read
+    assert {"/css/main.css", "/2.html", "https://toto.skyrock.com/", "/img/unquoted.gif", "https://www.skyrock.com/"} <= links
+    # Entities are decoded
+    assert "/search.html?q=a&page=2" in links
+    # Nothing is taken from comments, scripts, styles, srcset or escaped text
+    assert not {"/commented.html", "/img/commented.gif", "/from-script.html", "/img/from-script.gif", "/redirect.html",
+                "/img/bg.gif", "/img/inline-style.gif", "/img/photo-3x.jpg", "/img/source.webp", "/escaped.html"} & links
@@ -0,0 +1,73 @@
+import random
+
+import pytest
+
+from models.link import Link
+from models.resource import Resource
+
+from skydump import remap_html_page, remap_css_page, remap_html_links, remap_css_links
+
+
+URLS = ["/a.gif", "http://x/a.gif?b=1&c=2", "/c d.png", "a<b>.png", "/a.gif2", "http://y/z.css", "../img/p.gif", "a"]
+
+
+def make_link(original_url, local_url):
+    return Link(original_url=original_url, resource=Resource(local_url=local_url))
+
+
+def remap_html_chained(doc, origin_local_url, links):
+    for l in links:
+        doc = remap_html_page(doc, origin_local_url, l.original_url, l.resource.local_url)
+    return doc
+
+
+def remap_css_chained(doc, origin_local_url, links):
+    for l in links:
+        doc = remap_css_page(doc, origin_local_url, l.original_url, l.resource.local_url)
+    return doc
+
+
+def random_document(rnd, urls, stray_quotes):
+    tokens = []
+    for _ in range(rnd.randint(0, 12)):
+        url = rnd.choice(urls)
+        escaped_url = url.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+        choices = [f'<img src="{escaped_url}"/>', f"url({url})", f"url('{url}')", f' url("{url}") ', ' x="y" ', " text "]
+        if stray_quotes:
+            choices += ['"', f'{escaped_url}"', f'"{escaped_url}']
+        tokens.append(rnd.choice(choices))
+    return "".join(tokens)
+
+
+@pytest.mark.parametrize("doc, expected", [
+    ('"a"a"', '"../L"a"'),
+    ('"x"a"', '"x"../L"'),
+    ('"a""a"', '"../L""../L"'),
+    ('<a href="a">a</a>', '<a href="../L">a</a>'),
+    ('"a', '"a'),
+])
+def test_remap_html_quotes(doc, expected):
+    links = [make_link("a", "L")]
+    assert remap_html_links(doc, "d/p.html", links) == expected
+    assert remap_html_chained(doc, "d/p.html", links) == expected
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_remap_html_parity_single_url(seed):
+    # Any document, stray quotes included, is remapped like str.replace. With stray quotes, chained
+    # replaces of several links depend on the order of the links, matching across the replaced spans
+    rnd = random.Random(seed)
+    for _ in range(100):
+        links = [make_link(rnd.choice(URLS), f"h/{rnd.randint(0, 9)}.x")]
+        doc = random_document(rnd, URLS, stray_quotes=True)
+        assert remap_html_links(doc, "d/p.html", links) == remap_html_chained(doc, "d/p.html", links), doc
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_remap_parity_many_urls(seed):
+    rnd = random.Random(seed)
+    for _ in range(100):
+        links = [make_link(rnd.choice(URLS), f"h/{rnd.randint(0, 9)}.x") for _ in range(rnd.randint(0, 6))]
+        doc = random_document(rnd, URLS, stray_quotes=False)
+        assert remap_html_links(doc, "d/p.html", links) == remap_html_chained(doc, "d/p.html", links), doc
+        assert remap_css_links(doc, "d/p.css", links) == remap_css_chained(doc, "d/p.css", links), doc